@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,13 @@ LOGOUT_REDIRECT_URL = 'home'
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Static files get the security headers above, then are answered before anything else runs for
+    # them, and stay out of the metrics
+    'main.staticfiles.StaticFilesMiddleware',
+    # First after those for pages, so that its total time and query list cover every other middleware
+    'main.profiling.ProfilingMiddleware',
+    # Before anything reads the database, so that every query follows the request's routing
+    'main.db_router.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,9 +64,13 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'blogrepost_project.urls'
 
+# Serve the read-heavy pages from main.async_views; asgi.py turns this on
+ASYNC_VIEWS = os.environ.get('DJANGO_ASYNC_VIEWS') == '1'
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that reports render time to main.profiling.ProfilingMiddleware
+        'BACKEND': 'main.profiling.ProfiledDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -80,12 +92,118 @@ WSGI_APPLICATION = 'blogrepost_project.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'blogrepost_db',
-        'USER': 'blogrepost_user',
-        'PASSWORD': 'sn9emMa',
-        'HOST': 'localhost',
-        'PORT': '5432',
+        'NAME': os.environ.get('DJANGO_DB_NAME', 'blogrepost_db'),
+        'USER': os.environ.get('DJANGO_DB_USER', 'blogrepost_user'),
+        'PASSWORD': os.environ.get('DJANGO_DB_PASSWORD', 'sn9emMa'),
+        'HOST': os.environ.get('DJANGO_DB_HOST', 'localhost'),
+        'PORT': os.environ.get('DJANGO_DB_PORT', '5432'),
+        # Seconds a connection is kept across requests. Under ASGI every request queries from a
+        # thread of its own, where kept connections would pile up, so there it defaults to 0
+        'CONN_MAX_AGE': int(os.environ.get('DJANGO_DB_CONN_MAX_AGE', '0' if ASYNC_VIEWS else '60')),
+        # A kept connection is checked before a request reuses it and replaced if the server dropped it
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# DJANGO_DB_POOL=1 takes connections from a psycopg 3 pool per worker process instead, which
+# also suits ASGI; Django returns them to the pool at the end of each request
+if os.environ.get('DJANGO_DB_POOL') == '1':
+    DATABASES['default']['CONN_MAX_AGE'] = 0  # Pooling replaces persistent connections
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.environ.get('DJANGO_DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.environ.get('DJANGO_DB_POOL_MAX_SIZE', '10')),
+            # Seconds a request waits for a free connection before failing
+            'timeout': float(os.environ.get('DJANGO_DB_POOL_TIMEOUT', '10')),
+        },
     }
+
+# Read replicas of 'default', one alias per host in DJANGO_DB_REPLICA_HOSTS (comma separated).
+# In tests they mirror 'default', so routing runs against the one test database.
+for number, host in enumerate(filter(None, os.environ.get('DJANGO_DB_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+
+# Aliases main.db_router.PrimaryReplicaRouter sends plain reads to; none sends everything to 'default'
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['main.db_router.PrimaryReplicaRouter']
+# Seconds a client keeps reading from the primary after one of its requests wrote, to hide replica lag
+REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# File-based so that every worker process sees the same entries and invalidations
+
+CACHES = {
+    # Only version keys (the listing's and one per user's calendar), sized so it never culls them
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'django_cache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    # Rendered cards and calendar windows: many and disposable, so culling them never evicts a version
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'django_cache' / 'fragments',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+    # Kept apart, so that culling fragments never evicts sessions
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'django_cache' / 'sessions',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+
+# Sessions
+# DJANGO_SESSION_BACKEND picks where session data lives:
+#   cached_db       the 'sessions' cache, written through to the table; no query while cached
+#   signed_cookies  the client's signed cookie; no query and no table, but a stolen cookie stays
+#                   valid until it expires, since logging out cannot revoke it
+#   db              the table only, one query on every request
+# Expired rows are deleted by the clear_expired_sessions command
+
+SESSION_BACKENDS = {
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+    'db': 'django.contrib.sessions.backends.db',
+}
+SESSION_ENGINE = SESSION_BACKENDS[os.environ.get('DJANGO_SESSION_BACKEND', 'cached_db')]
+SESSION_CACHE_ALIAS = 'sessions'
+
+
+# Profiling and metrics
+# Every response carries a Server-Timing header; requests slower than the threshold are
+# logged with their full query list, for the given share of them
+
+PROFILING_SLOW_REQUEST_MS = 500
+PROFILING_SLOW_SAMPLE_RATE = 1.0
+
+# Every worker process writes its metric samples here, so /metrics/ can sum them across
+# gunicorn workers; None keeps metrics per process. Samples of exited workers are merged into an
+# archive when metrics are collected, so totals survive worker recycling; gunicorn.conf.py can
+# also archive them at once and start from an empty directory:
+#     from main.metrics import clear_worker_snapshots, mark_process_dead
+#     def on_starting(server): clear_worker_snapshots()
+#     def child_exit(server, worker): mark_process_dead(worker.pid)
+METRICS_DIR = BASE_DIR / 'django_metrics'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'main.profiling': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
 }
 
 
@@ -131,6 +249,56 @@ STATICFILES_DIRS = [
 
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
+STATICFILES_FINDERS = [
+    'django.contrib.staticfiles.finders.FileSystemFinder',
+    'django.contrib.staticfiles.finders.AppDirectoriesFinder',
+    'main.staticfiles.BundleFinder',
+]
+
+# One stylesheet per page layout, concatenated in this order from the files in static/styling;
+# bundles stay in styling/ so relative url()s keep working
+STATIC_BUNDLES = {
+    'styling/bundle-home.css': [
+        'styling/base.css', 'styling/layout.css', 'styling/nav.css', 'styling/home.css',
+    ],
+    'styling/bundle-forms.css': [
+        'styling/forms.css', 'styling/base.css',
+    ],
+    'styling/bundle-error.css': [
+        'styling/base.css', 'styling/components.css',
+    ],
+    'styling/bundle-profile.css': [
+        'styling/base.css', 'styling/accountstyle.css', 'styling/layout.css', 'styling/nav.css',
+    ],
+    'styling/bundle-public-profile.css': [
+        'styling/base.css', 'styling/accountstyle.css', 'styling/layout.css', 'styling/nav.css',
+        'styling/inline-edit.css',
+    ],
+    'styling/bundle-request.css': [
+        'styling/base.css', 'styling/style.css', 'styling/layout.css', 'styling/nav.css',
+    ],
+    'styling/bundle-requests.css': [
+        'styling/base.css', 'styling/components.css', 'styling/style.css', 'styling/layout.css',
+        'styling/nav.css', 'styling/inline-edit.css',
+    ],
+    'styling/bundle-available-requests.css': [
+        'styling/base.css', 'styling/layout.css', 'styling/components.css', 'styling/nav.css',
+        'styling/inline-edit.css', 'styling/message.css',
+    ],
+}
+# Where main.staticfiles.BundleFinder writes the bundles
+STATIC_BUNDLES_DIR = BASE_DIR / 'static_bundles'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    # Fingerprinted names plus .gz/.br variants, served by main.staticfiles.StaticFilesMiddleware
+    'staticfiles': {
+        'BACKEND': 'main.staticfiles.CompressedManifestStaticFilesStorage',
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -51,11 +51,6 @@ class BlogRequestAdmin(admin.ModelAdmin):
     fields = ('user', 'book_name', 'litnet_link', 'vk_link',
               'start_date', 'available_from', 'available_to')
 
-    def acceptance_count(self, obj):
-        return SavedRequest.objects.filter(request=obj).count()
-
-    acceptance_count.short_description = 'Acceptances'
-
     # Allow admin to create requests for any user
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == "user":
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        # Register the calendar cache and listing invalidation and match score signal handlers
+        from . import calendar_cache, conditional, matching  # noqa: F401
@@ -0,0 +1,74 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
+from django.shortcuts import aget_object_or_404, render
+
+from .availability import compute_free_slots
+from .card_cache import available_request_cards
+from .conditional import (
+    available_requests_validators, conditional_page, public_profile_validators, request_details_validators,
+)
+from .models import BlogRequest, SavedRequest
+from .views import (
+    _available_requests_context, _available_requests_query, _cards_queryset, _cut_sorted_page,
+    _earliest_free_keys, _earliest_free_windows, _sorted_page_queryset,
+)
+
+# Async twins of the read-heavy pages in main.views, routed by main.urls when ASYNC_VIEWS is on.
+# Queries go through the async ORM; templates still read request.user, the session and messages
+# synchronously, so rendering runs in a worker thread.
+arender = sync_to_async(render)
+
+__all__ = ['home', 'public_profile', 'available_requests', 'request_details']
+
+
+async def _alist(queryset):
+    return [obj async for obj in queryset]
+
+
+async def home(request):
+    return await arender(request, "webui/home.html")
+
+
+@conditional_page(public_profile_validators)
+async def public_profile(request, user_id):
+    # The profile comes in the same query instead of a second lazy one
+    author = await aget_object_or_404(User.objects.select_related('profile'), pk=user_id)
+    return await arender(request, 'webui/public-profile.html', {
+        'author': author,
+        'profile': author.profile,
+    })
+
+
+@login_required
+@conditional_page(available_requests_validators)
+async def available_requests(request):
+    user = await request.auser()
+    query = _available_requests_query(request, user)
+    if query['sort'] == 'earliest':
+        availability = compute_free_slots(await _alist(_earliest_free_windows(query['qs'])))
+        page_keys, next_cursor = _earliest_free_keys(availability, query['cursor'])
+        by_id = await _cards_queryset(query['qs'], query['saved_qs']).ain_bulk([pk for _, pk in page_keys])
+        requests = [by_id[pk] for _, pk in page_keys if pk in by_id]
+        context = _available_requests_context(query, requests, next_cursor, availability)
+    else:
+        requests = await _alist(_sorted_page_queryset(
+            query['qs'], query['saved_qs'], query['cursor'], query['sort'], user))
+        context = _available_requests_context(query, *_cut_sorted_page(requests, query['sort']))
+    context['cards'] = await sync_to_async(available_request_cards)(request, context)
+    return await arender(request, 'webui/available-requests.html', context)
+
+
+@login_required
+@conditional_page(request_details_validators)
+async def request_details(request, pk):
+    user = await request.auser()
+    blog_request = await aget_object_or_404(BlogRequest, pk=pk, user=user)
+    acceptances = await _alist(
+        SavedRequest.objects.filter(request=blog_request)
+        .select_related('user', 'user__profile').order_by('-created_at'))
+    return await arender(request, 'webui/request-details.html', {
+        'blog_request': blog_request,
+        'acceptances': acceptances,
+        'acceptance_count': blog_request.acceptance_count,
+    })
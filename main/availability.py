@@ -0,0 +1,76 @@
+from datetime import date, timedelta
+
+
+class DayBitmap:
+    """A set of days stored as an integer bitset: bit N stands for ``origin + N days``."""
+
+    def __init__(self, origin, bits=0):
+        self.origin = origin
+        self.bits = bits
+
+    @classmethod
+    def from_bytes(cls, origin, data):
+        return cls(origin, int.from_bytes(bytes(data or b''), 'little'))
+
+    @classmethod
+    def from_dates(cls, origin, dates):
+        bits = 0
+        for day in dates:
+            offset = (day - origin).days
+            if offset >= 0:
+                bits |= 1 << offset
+        return cls(origin, bits)
+
+    def to_bytes(self):
+        return self.bits.to_bytes((self.bits.bit_length() + 7) // 8, 'little')
+
+    def set(self, day, blocked=True):
+        # Days before the origin have no bit, as in from_dates
+        offset = (day - self.origin).days
+        if offset >= 0:
+            self.bits = self.bits | 1 << offset if blocked else self.bits & ~(1 << offset)
+
+    def __contains__(self, day):
+        offset = (day - self.origin).days
+        return offset >= 0 and bool(self.bits >> offset & 1)
+
+    def ranges(self):
+        # Runs of consecutive days as (first, last) pairs, e.g. for flatpickr's {from, to} disable ranges
+        runs = []
+        bits = self.bits
+        offset = 0
+        while bits:
+            skip = (bits & -bits).bit_length() - 1
+            bits >>= skip
+            offset += skip
+            length = (~bits & (bits + 1)).bit_length() - 1
+            runs.append((self.origin + timedelta(days=offset), self.origin + timedelta(days=offset + length - 1)))
+            bits >>= length
+            offset += length
+        return runs
+
+
+def compute_free_slots(windows, today=None):
+    """Earliest free date and number of free days for many requests in one pass.
+
+    ``windows`` is an iterable of ``(request_id, available_from, available_to, blocked_days)``
+    where ``blocked_days`` is the stored ``BlogRequest.blocked_days`` bitmap. Each window
+    becomes a bitset, blocked days and days before today are masked out, and the lowest
+    set bit and popcount give the answer without touching the database.
+    Returns ``{request_id: (earliest_free_date or None, free_count)}``.
+    """
+    today = today or date.today()
+    result = {}
+    for request_id, available_from, available_to, blocked_days in windows:
+        days = (available_to - available_from).days + 1
+        free = (1 << days) - 1 if days > 0 else 0
+        free &= ~DayBitmap.from_bytes(available_from, blocked_days).bits
+        past = (today - available_from).days
+        if past > 0:
+            free &= ~((1 << past) - 1)
+        if free:
+            earliest = available_from + timedelta(days=(free & -free).bit_length() - 1)
+            result[request_id] = (earliest, free.bit_count())
+        else:
+            result[request_id] = (None, 0)
+    return result
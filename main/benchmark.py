@@ -0,0 +1,546 @@
+import asyncio
+import io
+import json
+import queue
+import random
+import statistics
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import date, timedelta
+from types import ModuleType
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.backends.signals import connection_created
+from django.middleware.csrf import CSRF_SECRET_LENGTH
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, include, path, reverse
+from django.utils.crypto import get_random_string
+
+from blogrepost_project import urls as project_urls
+
+from . import async_views, urls, views
+from .availability import DayBitmap
+from .matching import rebuild_all
+from .models import GENRE_CHOICES, GROUPSIZE_CHOICES, GROUPSIZE_RANGES, BlogRequest, DateSlot, SavedRequest, UserProfile
+
+
+def seed(users=200, requests=1000, saves=3000, hot_days=7, seed=0):
+    """Create a reproducible marketplace of ``users`` profiles, ``requests`` BlogRequests and up to
+    ``saves`` SavedRequests. Windows overlap and due dates cluster on ``hot_days`` days, so most
+    bookings compete for the same dates. The first user owns requests, books others' and is used as
+    the viewer. Nobody can log in: accounts have unusable passwords and no staff rights, since the
+    benchmarks log in with force_login. Returns ``(viewer, blog_requests)``.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    prefix = f'bench{time.time_ns()}'
+
+    accounts = [User(username=f'{prefix}-{i}') for i in range(users)]
+    for account in accounts:
+        account.set_unusable_password()
+    accounts = User.objects.bulk_create(accounts)
+    profiles = []
+    for account in accounts:
+        # bulk_create bypasses UserProfile.save, which normally derives audience_size
+        size = rng.choice(GROUPSIZE_CHOICES)[0]
+        profiles.append(UserProfile(user=account, genres=rng.choice(GENRE_CHOICES)[0],
+                                    subscribers_count=size, audience_size=GROUPSIZE_RANGES[size][0]))
+    UserProfile.objects.bulk_create(profiles)
+
+    blog_requests = []
+    for i in range(requests):
+        available_from = today + timedelta(days=rng.randint(-hot_days, hot_days))
+        available_to = available_from + timedelta(days=rng.randint(hot_days, 6 * hot_days))
+        blog_requests.append(BlogRequest(
+            user=accounts[0] if i % 20 == 0 else rng.choice(accounts),
+            book_name=f'Book {i}',
+            author_page_link='https://example.com/book',
+            litnet_link='https://litnet.com/author',
+            vk_link='https://vk.com/author',
+            start_date=available_from + timedelta(days=rng.randint(0, hot_days)),
+            available_from=available_from,
+            available_to=available_to,
+        ))
+    blog_requests = BlogRequest.objects.bulk_create(blog_requests, batch_size=500)
+
+    # bulk_create skips the post_save receivers, so create the slots the way sync_date_slots would
+    slots = []
+    for br in blog_requests:
+        for offset in range((br.available_to - br.available_from).days + 1):
+            slots.append(DateSlot(request=br, date=br.available_from + timedelta(days=offset),
+                                  is_unavailable=rng.random() < 0.1))
+    DateSlot.objects.bulk_create(slots, batch_size=1000)
+
+    # Due dates from the hot days shared by all windows; duplicates are dropped instead of retried
+    hot = [today + timedelta(days=offset) for offset in range(hot_days)]
+    booked_days = set()
+    booked_pairs = set()
+    bookings = []
+    for _ in range(saves):
+        br = rng.choice(blog_requests)
+        reposter = rng.choice(accounts)
+        day = rng.choice(hot)
+        if (reposter == br.user or not br.available_from <= day <= br.available_to
+                or (br.pk, day) in booked_days or (reposter.pk, br.pk) in booked_pairs):
+            continue
+        booked_days.add((br.pk, day))
+        booked_pairs.add((reposter.pk, br.pk))
+        bookings.append(SavedRequest(user=reposter, request=br, share_due_date=day))
+    SavedRequest.objects.bulk_create(bookings, batch_size=1000)
+
+    # Nor are the blocked-day bitmaps built, which the free-slot figures and booking checks read
+    blocked = {br.pk: [] for br in blog_requests}
+    for slot in slots:
+        if slot.is_unavailable:
+            blocked[slot.request_id].append(slot.date)
+    for saved in bookings:
+        blocked[saved.request_id].append(saved.share_due_date)
+    for br in blog_requests:
+        br.blocked_days = DayBitmap.from_dates(br.available_from, blocked[br.pk]).to_bytes()
+    BlogRequest.objects.bulk_update(blog_requests, ['blocked_days'], batch_size=500)
+
+    rebuild_all()
+    return accounts[0], blog_requests
+
+
+def free_booking(viewer, blog_requests, today=None):
+    # A (request, day) pair the viewer can book and cancel repeatedly
+    today = today or date.today()
+    saved = set(SavedRequest.objects.filter(user=viewer).values_list('request_id', flat=True))
+    for br in BlogRequest.objects.filter(pk__in=[br.pk for br in blog_requests], available_to__gt=today) \
+            .exclude(user=viewer).exclude(pk__in=saved).order_by('pk'):
+        day = max(today, br.available_from)
+        while day <= br.available_to:
+            if day not in br.blocked_bitmap:
+                return br, day
+            day += timedelta(days=1)
+    return None, None
+
+
+def benchmark_cases(viewer, blog_requests):
+    """Named ``(method, path, data)`` requests covering every main view and the admin changelists."""
+    own_request = BlogRequest.objects.filter(user=viewer).order_by('-acceptance_count', 'pk').first()
+    available = reverse('available_requests')
+    cases = {
+        'home': ('get', reverse('home'), None),
+        'available_requests': ('get', available, None),
+        'available_requests?genre': ('get', available, {'genre': 'genre1'}),
+        'available_requests?genre&groupsize': ('get', available, {'genre': 'genre1', 'groupsize': 'size2'}),
+        'available_requests?sort=match': ('get', available, {'sort': 'match'}),
+        'available_requests?sort=earliest': ('get', available, {'sort': 'earliest'}),
+        'show_requests': ('get', reverse('requests'), None),
+        'request_details': ('get', reverse('request_details', args=[own_request.pk]), None),
+        'public_profile': ('get', reverse('public_profile', args=[own_request.user_id]), None),
+        'admin:blogrequest_changelist': ('get', reverse('admin:main_blogrequest_changelist'), None),
+        'admin:savedrequest_changelist': ('get', reverse('admin:main_savedrequest_changelist'), None),
+        'admin:userprofile_changelist': ('get', reverse('admin:main_userprofile_changelist'), None),
+        'admin:user_changelist': ('get', reverse('admin:auth_user_changelist'), None),
+    }
+    br, day = free_booking(viewer, blog_requests)
+    if br is not None:
+        # Book and cancel alternate, leaving the data as it was after every pair of runs
+        toggle = reverse('toggle-save-request', args=[br.pk])
+        cases['toggle_save_request:book'] = ('post', toggle, {'share_due_date': day.strftime('%Y-%m-%d')})
+        cases['toggle_save_request:cancel'] = ('post', toggle, {})
+    return cases
+
+
+@contextmanager
+def staff_rights(user):
+    # The admin pages need a staff user. The rights are granted in a savepoint that is rolled back,
+    # so a staff account is never committed, even with benchmark_views --keep
+    with transaction.atomic():
+        User.objects.filter(pk=user.pk).update(is_staff=True, is_superuser=True)
+        yield
+        transaction.set_rollback(True)
+
+
+def run_benchmark(viewer, cases, repeat=5):
+    """Time every case ``repeat`` times as ``viewer``; returns ``{name: stats}`` in milliseconds.
+    Cases named ``admin:...`` run with the viewer's staff_rights.
+    """
+    client = Client()
+    client.force_login(viewer)
+    results = {name: {'wall_ms': [], 'queries': []} for name in cases}
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        for _ in range(repeat):
+            for name, (method, path, data) in cases.items():
+                with staff_rights(viewer) if name.startswith('admin:') else nullcontext():
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        response = getattr(client, method)(path, data)
+                        elapsed = time.perf_counter() - started
+                results[name]['status'] = response.status_code
+                results[name]['wall_ms'].append(elapsed * 1000)
+                results[name]['queries'].append(len(queries))
+
+    report = {}
+    for name, result in results.items():
+        wall_ms = result['wall_ms']
+        report[name] = {
+            'status': result['status'],
+            'queries': max(result['queries']),
+            'wall_ms': {
+                'min': round(min(wall_ms), 3),
+                'median': round(statistics.median(wall_ms), 3),
+                'max': round(max(wall_ms), 3),
+            },
+        }
+    return report
+
+
+def write_report(command, report, output, summary=()):
+    """Write ``report`` as JSON to the ``output`` path, or to the command's stdout for ``'-'``.
+    After a file is written, the ``summary`` lines go to stdout instead.
+    """
+    content = json.dumps(report, indent=2, sort_keys=True, ensure_ascii=False) + '\n'
+    if output == '-':
+        command.stdout.write(content, ending='')
+        return
+
+    with open(output, 'w', encoding='utf-8') as report_file:
+        report_file.write(content)
+    for line in summary:
+        command.stdout.write(line)
+    command.stdout.write(command.style.SUCCESS(f"Wrote {output}."))
+
+
+def cleanup(viewer):
+    # Remove everything seed() created; requests, slots, bookings and scores cascade
+    prefix = viewer.username.rsplit('-', 1)[0]
+    User.objects.filter(username__startswith=f'{prefix}-').delete()
+
+
+def urlconf(read_views):
+    """The project URLconf with the read-heavy pages served by ``read_views``: main.views or main.async_views."""
+    patterns = []
+    for pattern in urls.urlpatterns:
+        name = getattr(pattern.callback, '__name__', '')
+        if isinstance(pattern, URLPattern) and name in async_views.__all__:
+            pattern = path(str(pattern.pattern), getattr(read_views, name), name=pattern.name)
+        patterns.append(pattern)
+    # A module object, since resolvers are cached per URLconf and need it hashable
+    module = ModuleType(f'{__name__}.urlconf_{read_views.__name__.rsplit(".", 1)[-1]}')
+    module.urlpatterns = [
+        path('admin/', admin.site.urls),
+        path('', include(patterns)),
+    ]
+    module.handler404 = project_urls.handler404
+    return module
+
+
+def _wsgi_get(handler, url, cookie):
+    return _wsgi_request(handler, 'GET', url, cookie)
+
+
+def _wsgi_request(handler, method, url, cookie, body=b''):
+    path_info, _, query = url.partition('?')
+    status = []
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': query,
+        'SCRIPT_NAME': '',
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'testserver',
+        'HTTP_COOKIE': cookie,
+        'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': io.StringIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    response = handler(environ, lambda line, headers, exc_info=None: status.append(int(line.split()[0])))
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return status[0]
+
+
+async def _asgi_get(application, url, cookie):
+    path_info, _, query = url.partition('?')
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path_info,
+        'raw_path': path_info.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+    body_sent = False
+    disconnected = asyncio.Event()
+    status = []
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # The handler listens for a disconnect until the response is sent
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    disconnected.set()
+    return status[0]
+
+
+def _throughput_stats(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': sum(1 for status in statuses if status >= 400),
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 3),
+    }
+
+
+def wsgi_throughput(urls_to_get, cookie, concurrency):
+    # Thread pool in front of the WSGI handler, like a threaded WSGI server
+    handler = WSGIHandler()
+    pending = queue.Queue()
+    for url in urls_to_get:
+        pending.put(url)
+    latencies, statuses = [], []
+
+    def worker():
+        try:
+            while True:
+                try:
+                    url = pending.get_nowait()
+                except queue.Empty:
+                    return
+                started = time.perf_counter()
+                statuses.append(_wsgi_get(handler, url, cookie))
+                latencies.append(time.perf_counter() - started)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return _throughput_stats(latencies, statuses, time.perf_counter() - started)
+
+
+def asgi_throughput(urls_to_get, cookie, concurrency):
+    # Concurrent tasks on one event loop calling the ASGI handler, like an ASGI server
+    application = ASGIHandler()
+    latencies, statuses = [], []
+
+    async def run():
+        pending = asyncio.Queue()
+        for url in urls_to_get:
+            pending.put_nowait(url)
+
+        async def worker():
+            while not pending.empty():
+                url = pending.get_nowait()
+                started = time.perf_counter()
+                statuses.append(await _asgi_get(application, url, cookie))
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(run())
+    return _throughput_stats(latencies, statuses, elapsed)
+
+
+def compare_sync_async(viewer, blog_requests, concurrency=16, total=400):
+    """Throughput of the read-heavy pages: sync views behind WSGI versus async views behind ASGI.
+
+    Both sides run against the same committed data and database, with ``concurrency`` requests
+    in flight until ``total`` have been served.
+    """
+    own_request = BlogRequest.objects.filter(user=viewer).order_by('-acceptance_count', 'pk').first()
+    pages = [
+        reverse('home'),
+        reverse('available_requests'),
+        f"{reverse('available_requests')}?{urlencode({'sort': 'earliest'})}",
+        reverse('public_profile', args=[own_request.user_id]),
+        reverse('request_details', args=[own_request.pk]),
+    ]
+    urls_to_get = [pages[i % len(pages)] for i in range(total)]
+
+    client = Client()
+    client.force_login(viewer)
+    cookie = f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+    report = {}
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        with override_settings(ROOT_URLCONF=urlconf(views)):
+            report['wsgi_sync'] = wsgi_throughput(urls_to_get, cookie, concurrency)
+        with override_settings(ROOT_URLCONF=urlconf(async_views)):
+            report['asgi_async'] = asgi_throughput(urls_to_get, cookie, concurrency)
+    return report
+
+
+# Connection handling compared by connection_latency: Django's default of one connection per
+# request, persistent connections with health checks, and a psycopg 3 pool
+CONNECTION_MODES = {
+    'per_request': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False},
+    'persistent': {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': True},
+    'pooled': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'pool': True},
+}
+
+
+def _pool_available():
+    if connection.vendor != 'postgresql':
+        return False
+    try:
+        import psycopg_pool  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _configure_default(settings_dict):
+    # Replace the current thread's default connection with one built from settings_dict
+    current = connections[DEFAULT_DB_ALIAS]
+    current.close()
+    if getattr(current, 'pool', None) is not None:
+        current.close_pool()
+    connections.settings[DEFAULT_DB_ALIAS] = settings_dict
+    connections[DEFAULT_DB_ALIAS] = connections.create_connection(DEFAULT_DB_ALIAS)
+
+
+def connection_latency(viewer, blog_requests, total=300):
+    """Latency of short views under each of CONNECTION_MODES, through the WSGI handler.
+
+    Requests run one after another and cycle through booking a free day with toggle_save_request,
+    cancelling it and reading the request's availability, so connection setup is a large share
+    of each. The report also counts the connections Django opened; pooled ones come from the pool.
+    """
+    blog_request, day = free_booking(viewer, blog_requests)
+    toggle = reverse('toggle-save-request', args=[blog_request.pk])
+    csrf_secret = get_random_string(CSRF_SECRET_LENGTH)
+    book = urlencode({'csrfmiddlewaretoken': csrf_secret, 'share_due_date': day.strftime('%Y-%m-%d')})
+    cancel = urlencode({'csrfmiddlewaretoken': csrf_secret})
+    cycle = [
+        ('POST', toggle, book.encode()),
+        ('POST', toggle, cancel.encode()),
+        ('GET', reverse('request_availability', args=[blog_request.pk]), b''),
+    ]
+
+    client = Client()
+    client.force_login(viewer)
+    cookie = (f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}; '
+              f'{settings.CSRF_COOKIE_NAME}={csrf_secret}')
+
+    opened = []
+
+    def count_connection(sender, connection, **kwargs):
+        opened.append(connection.alias)
+
+    original = connections.settings[DEFAULT_DB_ALIAS]
+    report = {}
+    handler = WSGIHandler()
+    connection_created.connect(count_connection)
+    try:
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for mode, overrides in CONNECTION_MODES.items():
+                if overrides.get('pool') and not _pool_available():
+                    report[mode] = {'skipped': 'needs PostgreSQL with psycopg 3 and psycopg_pool'}
+                    continue
+                options = {key: value for key, value in original.get('OPTIONS', {}).items() if key != 'pool'}
+                if overrides.get('pool'):
+                    options['pool'] = True
+                _configure_default({
+                    **original,
+                    'CONN_MAX_AGE': overrides['CONN_MAX_AGE'],
+                    'CONN_HEALTH_CHECKS': overrides['CONN_HEALTH_CHECKS'],
+                    'OPTIONS': options,
+                })
+
+                opened.clear()
+                latencies, statuses = [], []
+                started = time.perf_counter()
+                try:
+                    for i in range(total):
+                        method, url, body = cycle[i % len(cycle)]
+                        request_started = time.perf_counter()
+                        statuses.append(_wsgi_request(handler, method, url, cookie, body))
+                        latencies.append(time.perf_counter() - request_started)
+                finally:
+                    # An odd number of requests may leave the day booked
+                    SavedRequest.objects.filter(user=viewer, request=blog_request).delete()
+                report[mode] = _throughput_stats(latencies, statuses, time.perf_counter() - started)
+                report[mode]['connections_opened'] = opened.count(DEFAULT_DB_ALIAS)
+    finally:
+        connection_created.disconnect(count_connection)
+        _configure_default(original)
+    return report
+
+
+def session_queries(viewer, blog_requests, repeat=5):
+    """Queries and wall time of authenticated pages under each of settings.SESSION_BACKENDS.
+
+    ``session_queries`` counts the statements on the session table per request: one with the db
+    backend, none for cached_db once the session is cached and none for signed cookies.
+    """
+    own_request = BlogRequest.objects.filter(user=viewer).order_by('-acceptance_count', 'pk').first()
+    pages = {
+        'home': reverse('home'),
+        'available_requests': reverse('available_requests'),
+        'request_details': reverse('request_details', args=[own_request.pk]),
+        'request_availability': reverse('request_availability', args=[own_request.pk]),
+    }
+    report = {}
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        for backend, engine in settings.SESSION_BACKENDS.items():
+            with override_settings(SESSION_ENGINE=engine):
+                client = Client()
+                client.force_login(viewer)
+                results = report[backend] = {}
+                for name, url in pages.items():
+                    # The first request fills the session cache
+                    client.get(url)
+                    wall_ms, queries = [], []
+                    for _ in range(repeat):
+                        with CaptureQueriesContext(connection) as captured:
+                            started = time.perf_counter()
+                            response = client.get(url)
+                            wall_ms.append((time.perf_counter() - started) * 1000)
+                        queries.append(captured.captured_queries)
+                    results[name] = {
+                        'status': response.status_code,
+                        'queries': max(len(run) for run in queries),
+                        'session_queries': max(
+                            sum('django_session' in query['sql'] for query in run) for run in queries
+                        ),
+                        'wall_ms': round(statistics.median(wall_ms), 3),
+                    }
+                client.logout()
+    return report
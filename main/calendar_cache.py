@@ -0,0 +1,98 @@
+import time
+
+from django.core.cache import cache, caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .metrics import CACHE_LOOKUPS
+from .models import BlogRequest, SavedRequest
+
+# Entries are invalidated by the signals below; the timeout only bounds stale data if a write bypasses them
+CALENDAR_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def calendar_version_key(user_id):
+    return f'home-calendar-version:{user_id}'
+
+
+def calendar_version(user_id):
+    # Every cached window of a user embeds this version, so replacing it drops them all at once
+    key = calendar_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        cache.set(key, version, None)
+    return version
+
+
+def calendar_cache_key(user_id, date_from, date_to):
+    return f'home-calendar:{user_id}:{calendar_version(user_id)}:{date_from:%Y%m%d}-{date_to:%Y%m%d}'
+
+
+def build_calendar(user, date_from, date_to):
+    # Read from the primary: the result is cached for CALENDAR_CACHE_TIMEOUT under a version that
+    # changed at the commit, so a lagging replica's dates would stick that long
+
+    # Green days: start dates of other users' requests this user has saved
+    action_dates = [
+        d.strftime("%Y-%m-%d") for d in
+        BlogRequest.objects.using(DEFAULT_DB_ALIAS).filter(saves__user=user, start_date__range=(date_from, date_to))
+            .exclude(user=user).values_list('start_date', flat=True)
+    ]
+
+    # Blue days: due dates booked on requests this user created, date string => request id (for redirect)
+    blue_dates = SavedRequest.objects.using(DEFAULT_DB_ALIAS) \
+        .filter(request__user=user, share_due_date__range=(date_from, date_to)) \
+        .values_list('share_due_date', 'request_id')
+    request_due_map = {d.strftime("%Y-%m-%d"): request_id for d, request_id in blue_dates}
+
+    return {
+        'action_dates': action_dates,
+        'request_due_map': request_due_map,
+    }
+
+
+def get_calendar(user, date_from, date_to):
+    # Windows live with the cards, so that culling them never evicts the version they embed
+    fragments = caches['fragments']
+    key = calendar_cache_key(user.pk, date_from, date_to)
+    calendar = fragments.get(key)
+    if calendar is None:
+        CACHE_LOOKUPS.inc('calendar', 'miss')
+        calendar = build_calendar(user, date_from, date_to)
+        fragments.set(key, calendar, CALENDAR_CACHE_TIMEOUT)
+    else:
+        CACHE_LOOKUPS.inc('calendar', 'hit')
+    return calendar
+
+
+def invalidate_calendars(user_ids):
+    # Only once the change is committed: a reader rebuilding before that would store the old
+    # dates under the new version for the whole timeout
+    keys = [calendar_version_key(user_id) for user_id in set(user_ids) if user_id is not None]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+@receiver(post_save, sender=SavedRequest)
+@receiver(post_delete, sender=SavedRequest)
+def invalidate_saved_request_calendars(sender, instance, origin=None, **kwargs):
+    # The reposter's action dates and the request owner's due dates both change
+    if isinstance(origin, BlogRequest):
+        # Cascaded from deleting the request, whose owner is known
+        owner_id = origin.user_id
+    elif SavedRequest.request.is_cached(instance):
+        # Created with the request its view already loaded
+        owner_id = instance.request.user_id
+    else:
+        owner_id = BlogRequest.objects.filter(pk=instance.request_id).values_list('user_id', flat=True).first()
+    invalidate_calendars([instance.user_id, owner_id])
+
+
+@receiver(post_save, sender=BlogRequest)
+def invalidate_blog_request_calendars(sender, instance, created, update_fields=None, **kwargs):
+    # Only start_date feeds other calendars (reposters' action dates); a new request has no reposters yet.
+    # Deleted requests are covered by the cascaded SavedRequest deletes.
+    if created or (update_fields is not None and 'start_date' not in update_fields):
+        return
+    invalidate_calendars(instance.saves.values_list('user_id', flat=True))
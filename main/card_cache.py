@@ -0,0 +1,77 @@
+import hashlib
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import caches
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils import translation
+from django.utils.safestring import mark_safe
+
+from .metrics import CACHE_LOOKUPS
+
+# Entries never go stale since everything a card shows is part of its key; the timeout only evicts unused ones
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+# Bump when a card template changes, so cards rendered by the previous version are not reused
+CARD_CACHE_VERSION = 1
+# Cards are rendered with this in place of the per-session CSRF token, which is swapped in on every use
+CSRF_PLACEHOLDER = 'card-csrf-token'
+
+
+def card_cache_key(template_name, obj, key_parts):
+    parts = '|'.join(str(part) for part in key_parts)
+    # Cards link fingerprinted images, so every collectstatic that changes the manifest starts over
+    static_version = getattr(staticfiles_storage, 'manifest_hash', '')
+    digest = hashlib.md5(f'{translation.get_language()}|{static_version}|{parts}'.encode()).hexdigest()
+    return f'card:{CARD_CACHE_VERSION}:{template_name}:{obj.pk}:{digest}'
+
+
+def render_cards(request, template_name, objects, key_parts, context=None):
+    """Rendered ``template_name`` for each object, as ``req``, reusing cached HTML.
+
+    ``key_parts(obj)`` returns everything besides the object's pk that its card depends on:
+    modification timestamps, annotations, the viewer's saved state. All cards of a page are
+    read with one get_many and the missing ones written with one set_many.
+    """
+    keys = [card_cache_key(template_name, obj, key_parts(obj)) for obj in objects]
+    fragments = caches['fragments']
+    cards = fragments.get_many(keys)
+    missing = {}
+    for obj, key in zip(objects, keys):
+        if key not in cards:
+            cards[key] = missing[key] = render_to_string(
+                template_name, {**(context or {}), 'req': obj, 'csrf_token': CSRF_PLACEHOLDER})
+    if missing:
+        fragments.set_many(missing, CARD_CACHE_TIMEOUT)
+    CACHE_LOOKUPS.inc('cards', 'hit', amount=len(keys) - len(missing))
+    CACHE_LOOKUPS.inc('cards', 'miss', amount=len(missing))
+
+    csrf_token = get_token(request)
+    return [mark_safe(cards[key].replace(CSRF_PLACEHOLDER, csrf_token)) for key in keys]
+
+
+def _profile_version(user):
+    # Users created before profiles existed may have none; their cards show no profile fields
+    return getattr(getattr(user, 'profile', None), 'updated_at', None)
+
+
+def available_request_cards(request, context):
+    return render_cards(
+        request, 'webui/available-request-card.html', context['requests'],
+        lambda req: (req.updated_at, req.user.username, _profile_version(req.user), req.saved,
+                     req.earliest_free_date, req.free_slot_count, context['today']),
+        {'today': context['today']},
+    )
+
+
+def created_request_cards(request, blog_requests):
+    return render_cards(
+        request, 'webui/created-request-card.html', blog_requests,
+        lambda req: (req.updated_at, req.acceptance_count),
+    )
+
+
+def accepted_request_cards(request, blog_requests):
+    return render_cards(
+        request, 'webui/accepted-request-card.html', blog_requests,
+        lambda req: (req.updated_at, req.user.username, _profile_version(req.user)),
+    )
@@ -0,0 +1,135 @@
+import hashlib
+import time
+from datetime import date, datetime, timezone
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .models import BlogRequest, SavedRequest, UserProfile
+
+# Time of the last committed change to anything the available requests listing shows, in ns
+LISTING_VERSION_KEY = 'available-requests-version'
+
+
+def page_validators(request, parts, timestamps):
+    """(ETag, Last-Modified) of a page built from ``parts`` and rows last changed at ``timestamps``.
+
+    The ETag also covers the URL, the viewer and the CSRF secret the page's forms are signed with,
+    so a page cached before a login or by another user never matches. (None, None) disables
+    conditional handling.
+    """
+    # Flash messages are shown once, so a page that has some pending is always rendered
+    if len(messages.get_messages(request)):
+        return None, None
+    parts = [request.get_full_path(), request.user.pk, request.META.get('CSRF_COOKIE'), *parts, *timestamps]
+    etag = hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+    last_modified = max((ts for ts in timestamps if ts is not None), default=None)
+    return etag, last_modified
+
+
+def public_profile_validators(request, user_id):
+    row = UserProfile.objects.filter(user_id=user_id).values_list('user__username', 'updated_at').first()
+    if row is None:
+        return None, None
+    username, updated_at = row
+    return page_validators(request, [username], [updated_at])
+
+
+def request_details_validators(request, pk):
+    # The request, and its acceptances with their reposters' profiles; counts catch deletions
+    row = BlogRequest.objects.filter(pk=pk, user=request.user).annotate(
+        save_count=Count('saves'),
+        last_save=Max('saves__created_at'),
+        last_profile=Max('saves__user__profile__updated_at'),
+    ).values_list('save_count', 'updated_at', 'last_save', 'last_profile').first()
+    if row is None:
+        return None, None
+    save_count, *timestamps = row
+    return page_validators(request, [save_count], timestamps)
+
+
+def listing_version():
+    version = cache.get(LISTING_VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        cache.set(LISTING_VERSION_KEY, version, None)
+    return version
+
+
+def invalidate_listing():
+    # After the commit, like invalidate_calendars, so nobody renders the old rows under the new version
+    transaction.on_commit(lambda: cache.delete(LISTING_VERSION_KEY))
+
+
+def available_requests_validators(request):
+    # Any request, profile or booking may enter or leave the listing, so a single version covers
+    # them all: one cache lookup, no SQL. Urgency points also depend on today's date.
+    version = listing_version()
+    changed_at = datetime.fromtimestamp(version / 1e9, tz=timezone.utc)
+    return page_validators(request, [date.today(), version], [changed_at])
+
+
+def _not_modified(request, etag, last_modified):
+    if etag is None:
+        return None
+    return get_conditional_response(
+        request, etag=quote_etag(etag), last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+
+
+def _add_validators(response, etag, last_modified):
+    if etag is not None and response.status_code in (200, 304):
+        response.headers.setdefault('ETag', quote_etag(etag))
+        if last_modified:
+            response.headers.setdefault('Last-Modified', http_date(last_modified.timestamp()))
+        # Per-user pages: the browser keeps them but revalidates on every visit
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def conditional_page(validators):
+    """Answer GETs with 304 Not Modified, before the view runs, while ``validators`` match.
+
+    Like django.views.decorators.http.condition, but the ETag and Last-Modified come from one
+    ``validators(request, *args, **kwargs)`` call, which async views run in a worker thread.
+    """
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def inner(request, *args, **kwargs):
+                etag, last_modified = await sync_to_async(validators)(request, *args, **kwargs)
+                response = _not_modified(request, etag, last_modified)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return _add_validators(response, etag, last_modified)
+        else:
+            @wraps(view)
+            def inner(request, *args, **kwargs):
+                etag, last_modified = validators(request, *args, **kwargs)
+                response = _not_modified(request, etag, last_modified)
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                return _add_validators(response, etag, last_modified)
+        return inner
+
+    return decorator
+
+
+# Match scores are written after the commit by main.matching, which invalidates the listing again then
+
+@receiver(post_save, sender=BlogRequest)
+@receiver(post_delete, sender=BlogRequest)
+@receiver(post_save, sender=SavedRequest)
+@receiver(post_delete, sender=SavedRequest)
+@receiver(post_save, sender=UserProfile)
+def invalidate_listing_on_change(sender, **kwargs):
+    invalidate_listing()
@@ -0,0 +1,120 @@
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Cookie that keeps a client's reads on the primary for REPLICA_PIN_SECONDS after it wrote
+PIN_COOKIE = 'primary_pin'
+# Read on every request and written at every login, so a lagging replica would log users out
+PRIMARY_ONLY_APPS = {'sessions'}
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+# Routing state of the request being handled, None outside ReplicaPinningMiddleware
+current_routing = ContextVar('current_routing', default=None)
+
+
+class RequestRouting:
+    def __init__(self, pinned):
+        # Every read of the request goes to the primary
+        self.pinned = pinned
+        # The request asked for the primary to write, see PrimaryReplicaRouter.db_for_write
+        self.wrote = False
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+class PrimaryReplicaRouter:
+    """Plain reads go to a random DATABASE_REPLICAS alias, everything else to ``default``.
+
+    Reads stay on the primary inside a transaction there, for objects loaded from it, for the
+    PRIMARY_ONLY_APPS, and in requests ReplicaPinningMiddleware pins to it.
+    """
+
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return DEFAULT_DB_ALIAS
+        routing = current_routing.get()
+        if routing is not None and routing.pinned:
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db == DEFAULT_DB_ALIAS:
+            return DEFAULT_DB_ALIAS
+        # Row locks and the transaction's own writes are only visible on the primary
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        routing = current_routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema through replication
+        if db in replicas():
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """Keeps a client's reads on the primary while the replicas may not have its writes yet.
+
+    Requests with an unsafe method read from the primary throughout, so validation such as
+    toggle_save_request's sees the rows it is about to change. A request that wrote sets
+    PIN_COOKIE for REPLICA_PIN_SECONDS; until it expires, that client's reads, like the page a
+    save redirects to, stay on the primary too.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        routing = self.routing(request)
+        token = current_routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.finish(response, routing)
+
+    async def __acall__(self, request):
+        routing = self.routing(request)
+        token = current_routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        return self.finish(response, routing)
+
+    @staticmethod
+    def routing(request):
+        return RequestRouting(pinned=request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES)
+
+    @staticmethod
+    def finish(response, routing):
+        if routing.wrote and replicas():
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 5), httponly=True, samesite='Lax',
+            )
+        return response
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
@@ -93,22 +95,18 @@ class BlogRequestForm(forms.ModelForm):
 
     def clean_unavailable_dates(self):
         raw = self.cleaned_data['unavailable_dates']
-        # Split by comma, strip whitespace, validate as dates if needed
-        dates = [d.strip() for d in raw.split(',') if d.strip()]
+        # Split by comma, strip whitespace and parse each ISO date
+        dates = []
+        for value in raw.split(','):
+            value = value.strip()
+            if not value:
+                continue
+            try:
+                dates.append(datetime.strptime(value, '%Y-%m-%d').date())
+            except ValueError:
+                raise forms.ValidationError(f"Неверный формат даты: {value}")
         return dates
 
-    def save(self, commit=True):
-        instance = super().save(commit=False)
-        # Cleaned unavailable_dates: save as list/JSON
-        if isinstance(self.cleaned_data['unavailable_dates'], str):
-            dates = [d.strip() for d in self.cleaned_data['unavailable_dates'].split(',') if d.strip()]
-        else:
-            dates = self.cleaned_data['unavailable_dates']
-        instance.unavailable_dates = dates
-        if commit:
-            instance.save()
-        return instance
-
 
 
 class ProfileForm(forms.ModelForm):
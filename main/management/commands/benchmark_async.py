@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.benchmark import cleanup, compare_sync_async, seed, write_report
+
+
+class Command(BaseCommand):
+    help = ("Compare the throughput of the read-heavy pages served by sync views behind WSGI and by "
+            "async views behind ASGI, under concurrent load. The seeded data has to be committed for "
+            "the worker threads to see it, which needs --commit, and is deleted afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--saves', type=int, default=3000)
+        parser.add_argument('--concurrency', type=int, default=16, help="Requests in flight at once.")
+        parser.add_argument('--total', type=int, default=400, help="Requests served per side.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed of the generated dataset.")
+        parser.add_argument('--output', default='-', help="Report path, '-' for stdout.")
+        parser.add_argument('--commit', action='store_true',
+                            help="Allow committing the seeded data to the configured database.")
+
+    def handle(self, *args, **options):
+        if not options['commit']:
+            raise CommandError("The seeded data is committed for the worker threads to see it; "
+                               "pass --commit to allow that on this database.")
+        viewer, blog_requests = seed(options['users'], options['requests'], options['saves'], seed=options['seed'])
+        try:
+            report = compare_sync_async(viewer, blog_requests, options['concurrency'], options['total'])
+        finally:
+            cleanup(viewer)
+
+        report['scale'] = {key: options[key] for key in ('users', 'requests', 'saves', 'concurrency', 'total', 'seed')}
+        write_report(self, report, options['output'])
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.benchmark import cleanup, connection_latency, seed, write_report
+
+
+class Command(BaseCommand):
+    help = ("Compare the latency of short views (booking, cancelling, availability) with a new database "
+            "connection per request, persistent connections with health checks and a psycopg 3 pool. "
+            "The seeded data has to be committed for the new connections to see it, which needs --commit, "
+            "and is deleted afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--saves', type=int, default=400)
+        parser.add_argument('--total', type=int, default=300, help="Requests served per connection mode.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed of the generated dataset.")
+        parser.add_argument('--output', default='-', help="Report path, '-' for stdout.")
+        parser.add_argument('--commit', action='store_true',
+                            help="Allow committing the seeded data to the configured database.")
+
+    def handle(self, *args, **options):
+        if not options['commit']:
+            raise CommandError("The seeded data is committed for the new connections to see it; "
+                               "pass --commit to allow that on this database.")
+        viewer, blog_requests = seed(options['users'], options['requests'], options['saves'], seed=options['seed'])
+        try:
+            report = connection_latency(viewer, blog_requests, options['total'])
+        finally:
+            cleanup(viewer)
+
+        report['scale'] = {key: options[key] for key in ('users', 'requests', 'saves', 'total', 'seed')}
+        write_report(self, report, options['output'])
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.benchmark import seed, session_queries, write_report
+
+
+class Command(BaseCommand):
+    help = ("Compare the queries and wall time of authenticated pages with sessions in the database, "
+            "in the cache backed by the database, and in signed cookies. "
+            "The seeded data is rolled back afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--saves', type=int, default=400)
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs per page and backend.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed of the generated dataset.")
+        parser.add_argument('--output', default='-', help="Report path, '-' for stdout.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            viewer, blog_requests = seed(options['users'], options['requests'], options['saves'], seed=options['seed'])
+            report = session_queries(viewer, blog_requests, options['repeat'])
+            transaction.set_rollback(True)
+
+        write_report(self, report, options['output'], summary=[
+            f"{backend:15} {name:22} {result['queries']:3} queries "
+            f"({result['session_queries']} on sessions) {result['wall_ms']:8.1f} ms"
+            for backend, pages in report.items() for name, result in pages.items()
+        ])
@@ -0,0 +1,45 @@
+import platform
+from datetime import datetime
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from main.benchmark import benchmark_cases, run_benchmark, seed, write_report
+
+
+class Command(BaseCommand):
+    help = ("Seed a marketplace of the given scale, time every main view and admin changelist, "
+            "and write wall time and query count per view to a JSON report. "
+            "The seeded data is rolled back afterwards unless --keep is given.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--saves', type=int, default=3000)
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs per view.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed of the generated dataset.")
+        parser.add_argument('--output', default='benchmark.json', help="Report path, '-' for stdout.")
+        parser.add_argument('--keep', action='store_true', help="Commit the seeded data instead of rolling it back.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            viewer, blog_requests = seed(options['users'], options['requests'], options['saves'], seed=options['seed'])
+            views = run_benchmark(viewer, benchmark_cases(viewer, blog_requests), repeat=options['repeat'])
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+        report = {
+            'meta': {
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'database': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'scale': {key: options[key] for key in ('users', 'requests', 'saves', 'repeat', 'seed')},
+            },
+            'views': views,
+        }
+        write_report(self, report, options['output'], summary=[
+            f"{name:40} {result['status']:4} {result['queries']:5} queries {result['wall_ms']['median']:10.1f} ms"
+            for name, result in views.items()
+        ])
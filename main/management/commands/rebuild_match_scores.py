@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from main.matching import rebuild_all
+from main.models import MatchScore
+
+
+class Command(BaseCommand):
+    help = ("Recompute every reposter/request match score and drop closed requests. "
+            "Run once after deploying and then daily, since urgency points depend on the current date.")
+
+    def handle(self, *args, **options):
+        rebuild_all()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {MatchScore.objects.count()} match scores."))
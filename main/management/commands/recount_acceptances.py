@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.models import BlogRequest
+
+
+class Command(BaseCommand):
+    help = "Re-derive BlogRequest.acceptance_count from the SavedRequest table in one bulk UPDATE."
+
+    def handle(self, *args, **options):
+        updated = BlogRequest.objects.all().recount_acceptances()
+        self.stdout.write(self.style.SUCCESS(f"Recounted acceptances for {updated} requests."))
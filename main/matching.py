@@ -0,0 +1,174 @@
+from datetime import date
+from functools import partial
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .availability import compute_free_slots
+from .conditional import invalidate_listing
+from .models import GROUPSIZE_RANGES, BlogRequest, MatchScore, SavedRequest, UserProfile, deleted_with_request
+
+# Score = affinity (profiles) + request points (availability and urgency)
+GENRE_MATCH_POINTS = 40
+AUDIENCE_MATCH_POINTS = 30       # same group size; minus AUDIENCE_STEP_PENALTY per size step apart
+AUDIENCE_STEP_PENALTY = 10
+FREE_SLOT_POINTS = 2             # per bookable day left, up to FREE_SLOT_CAP days
+FREE_SLOT_CAP = 10
+URGENCY_DAYS = 10                # one point per day short of this until available_to
+
+GROUPSIZE_ORDER = list(GROUPSIZE_RANGES)
+
+
+def affinity(reposter_profile, owner_profile):
+    # Profiles are (genres, subscribers_count) tuples
+    points = 0
+    if reposter_profile[0] and reposter_profile[0] == owner_profile[0]:
+        points += GENRE_MATCH_POINTS
+    if reposter_profile[1] in GROUPSIZE_ORDER and owner_profile[1] in GROUPSIZE_ORDER:
+        steps = abs(GROUPSIZE_ORDER.index(reposter_profile[1]) - GROUPSIZE_ORDER.index(owner_profile[1]))
+        points += max(0, AUDIENCE_MATCH_POINTS - AUDIENCE_STEP_PENALTY * steps)
+    return points
+
+
+def request_points(free_slots, available_to, today):
+    if not free_slots:
+        return 0
+    days_left = (available_to - today).days
+    return min(free_slots, FREE_SLOT_CAP) * FREE_SLOT_POINTS + max(0, URGENCY_DAYS - days_left)
+
+
+# Scores are computed right after the commit that changed their inputs, so their reads go to the
+# primary: a replica may not have that commit yet, and the stale scores would stay until the next change
+
+def open_requests(today):
+    return BlogRequest.objects.using(DEFAULT_DB_ALIAS).filter(available_to__gte=today)
+
+
+def open_request_windows(today, request_ids=None):
+    # (pk, owner id, available_to, free days from today on) of open requests; free days come from
+    # the stored blocked-day bitmaps, so no DateSlot query is needed
+    qs = open_requests(today)
+    if request_ids is not None:
+        qs = qs.filter(pk__in=request_ids)
+    rows = list(qs.values_list('pk', 'user_id', 'available_from', 'available_to', 'blocked_days'))
+    free_slots = compute_free_slots([(pk, *window) for pk, _, *window in rows], today)
+    return [(pk, owner_id, available_to, free_slots[pk][1]) for pk, owner_id, _, available_to, _ in rows]
+
+
+def profiles(user_ids=None):
+    qs = UserProfile.objects.using(DEFAULT_DB_ALIAS)
+    if user_ids is not None:
+        qs = qs.filter(user_id__in=user_ids)
+    return {
+        user_id: (genres, subscribers_count)
+        for user_id, genres, subscribers_count in qs.values_list('user_id', 'genres', 'subscribers_count')
+    }
+
+
+def _upsert(scores):
+    MatchScore.objects.bulk_create(
+        scores,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['user', 'request'],
+        update_fields=['affinity', 'score'],
+    )
+    # Rankings changed after the listing's own handlers ran, at the commit
+    invalidate_listing()
+
+
+def refresh_requests(request_ids):
+    # Full recompute of every reposter's score for the given requests
+    today = date.today()
+    blog_requests = open_request_windows(today, request_ids)
+    MatchScore.objects.filter(request_id__in=request_ids).exclude(
+        request_id__in=[pk for pk, *_ in blog_requests]).delete()
+    if not blog_requests:
+        return
+
+    all_profiles = profiles()
+    scores = []
+    for pk, owner_id, available_to, free_slots in blog_requests:
+        owner_profile = all_profiles.get(owner_id, ('', ''))
+        points = request_points(free_slots, available_to, today)
+        for user_id, reposter_profile in all_profiles.items():
+            if user_id == owner_id:
+                continue
+            user_affinity = affinity(reposter_profile, owner_profile)
+            scores.append(MatchScore(user_id=user_id, request_id=pk, affinity=user_affinity,
+                                     score=user_affinity + points))
+    _upsert(scores)
+
+
+def refresh_request_points(request_id):
+    # Availability of one request changed: shift all its scores in a single UPDATE
+    today = date.today()
+    window = BlogRequest.objects.using(DEFAULT_DB_ALIAS).filter(pk=request_id) \
+        .values_list('available_from', 'available_to', 'blocked_days').first()
+    if window is None:
+        return
+    free_slots = compute_free_slots([(request_id, *window)], today)[request_id][1]
+    points = request_points(free_slots, window[1], today)
+    MatchScore.objects.filter(request_id=request_id).update(score=F('affinity') + points)
+    invalidate_listing()
+
+
+def refresh_points_on_commit(request_ids):
+    # Rewrites a row per reposter, so it waits for the booking's transaction and its row lock to end
+    for request_id in set(request_ids):
+        transaction.on_commit(partial(refresh_request_points, request_id))
+
+
+def refresh_user(user_id):
+    # A profile changed: recompute the user's rows as reposter and as owner of requests
+    today = date.today()
+    blog_requests = open_request_windows(today)
+    # Every profile is only needed to rescore the user's own requests
+    owner_ids = {owner_id for _, owner_id, _, _ in blog_requests}
+    all_profiles = profiles(None if user_id in owner_ids else {user_id, *owner_ids})
+    user_profile = all_profiles.get(user_id, ('', ''))
+
+    scores = []
+    for pk, owner_id, available_to, free_slots in blog_requests:
+        points = request_points(free_slots, available_to, today)
+        if owner_id == user_id:
+            pairs = [(reposter_id, affinity(profile, user_profile))
+                     for reposter_id, profile in all_profiles.items() if reposter_id != user_id]
+        else:
+            pairs = [(user_id, affinity(user_profile, all_profiles.get(owner_id, ('', ''))))]
+        scores.extend(MatchScore(user_id=reposter_id, request_id=pk, affinity=points_affinity,
+                                 score=points_affinity + points)
+                      for reposter_id, points_affinity in pairs)
+    _upsert(scores)
+
+
+def rebuild_all():
+    # Drop rows of closed requests and recompute everything; run daily since urgency depends on today
+    today = date.today()
+    MatchScore.objects.exclude(request__in=open_requests(today)).delete()
+    refresh_requests(list(open_requests(today).values_list('pk', flat=True)))
+
+
+# The handlers below defer the score writes to the commit, so they never run under the row locks
+# of a booking, and see the blocked-day bitmaps the transaction rebuilt
+
+@receiver(post_save, sender=BlogRequest)
+def refresh_blog_request_scores(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields is None or {'available_from', 'available_to'} & set(update_fields):
+        transaction.on_commit(partial(refresh_requests, [instance.pk]))
+
+
+@receiver(post_save, sender=SavedRequest)
+@receiver(post_delete, sender=SavedRequest)
+def refresh_saved_request_scores(sender, instance, **kwargs):
+    # The scores of a request being deleted go with it
+    if not deleted_with_request(kwargs.get('origin')):
+        refresh_points_on_commit([instance.request_id])
+
+
+@receiver(post_save, sender=UserProfile)
+def refresh_profile_scores(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'genres', 'subscribers_count'} & set(update_fields):
+        transaction.on_commit(partial(refresh_user, instance.user_id))
@@ -0,0 +1,292 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows, where workers are not forked and are only archived by mark_process_dead
+    fcntl = None
+
+from django.conf import settings
+
+# Seconds between snapshots of this process's samples to METRICS_DIR
+METRICS_FLUSH_INTERVAL = 1.0
+# Samples of exited workers, summed into one file in METRICS_DIR so that totals never go down
+ARCHIVE_NAME = 'archive.json'
+
+
+class Registry:
+    """Samples of every metric in this process, guarded by one lock.
+
+    With ``METRICS_DIR`` set, each worker process periodically writes its samples to
+    ``<METRICS_DIR>/<pid>.json`` and ``collect()`` sums the files of all workers, so any
+    worker can answer a scrape for the whole server. The file of an exited worker is merged
+    into the archive, which is summed too, so counters and histograms keep growing when
+    workers are recycled instead of looking like a reset.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.metrics = {}
+        self.pid = os.getpid()
+        self.last_flush = 0.0
+        # Whether <pid>.json was written by this process rather than an exited one with the same pid
+        self.snapshot_written = False
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def reset_after_fork(self):
+        # A forked worker starts from zero instead of re-reporting the parent's samples
+        if os.getpid() != self.pid:
+            self.pid = os.getpid()
+            self.last_flush = 0.0
+            self.snapshot_written = False
+            for metric in self.metrics.values():
+                metric.samples.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: [[list(labels), value if isinstance(value, float) else list(value)]
+                       for labels, value in metric.samples.items()]
+                for name, metric in self.metrics.items()
+            }
+
+    def flush(self):
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory:
+            return
+        self.reset_after_fork()
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        # One writer per process at a time; write then rename, so readers never see a half-written file
+        with self.flush_lock:
+            self.last_flush = time.monotonic()
+            path = directory / f'{self.pid}.json'
+            if not self.snapshot_written:
+                # The pid was reused: keep the samples of the exited process before replacing its file
+                archive_snapshot(path)
+                self.snapshot_written = True
+            tmp = directory / f'.{self.pid}.json.tmp'
+            tmp.write_text(json.dumps(self.snapshot()))
+            os.replace(tmp, path)
+
+    def maybe_flush(self):
+        if time.monotonic() - self.last_flush >= METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def collect(self):
+        # {metric name: {label values: value}} summed over the latest snapshot of every live worker
+        self.flush()
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if directory:
+            for path in Path(directory).glob('*.json'):
+                if path.stem.isdigit() and int(path.stem) != self.pid and not pid_alive(int(path.stem)):
+                    # An exited worker that no server hook reported
+                    archive_snapshot(path)
+            snapshots = []
+            # The archive is read after the workers were moved into it, so none is counted twice
+            for path in Path(directory).glob('*.json'):
+                if not (path.stem.isdigit() or path.name == ARCHIVE_NAME):
+                    continue
+                try:
+                    snapshots.append(json.loads(path.read_text()))
+                except (OSError, ValueError):
+                    continue  # replaced or removed while reading
+        else:
+            snapshots = [self.snapshot()]
+
+        totals = sum_snapshots(snapshots)
+        return {name: totals.get(name, {}) for name in self.metrics}
+
+    def render(self):
+        # Prometheus text exposition format 0.0.4
+        totals = self.collect()
+        lines = []
+        for name, samples in totals.items():
+            lines.extend(self.metrics[name].render(samples))
+        ratios = cache_hit_ratios(totals)
+        if ratios:
+            lines.append('# HELP blogrepost_cache_hit_ratio Share of cache lookups answered from the cache')
+            lines.append('# TYPE blogrepost_cache_hit_ratio gauge')
+            lines.extend(f'blogrepost_cache_hit_ratio{{cache="{cache_name}"}} {ratio}'
+                         for cache_name, ratio in sorted(ratios.items()))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def sum_snapshots(snapshots):
+    # {metric name: {label values: value}} over snapshots of Registry.snapshot's form
+    totals = {}
+    for snapshot in snapshots:
+        for name, samples in snapshot.items():
+            metric_totals = totals.setdefault(name, {})
+            for labels, value in samples:
+                labels = tuple(labels)
+                if isinstance(value, list):
+                    current = metric_totals.get(labels, [0] * len(value))
+                    metric_totals[labels] = [a + b for a, b in zip(current, value)]
+                else:
+                    metric_totals[labels] = metric_totals.get(labels, 0.0) + value
+    return totals
+
+
+@contextmanager
+def archive_lock(directory):
+    # Serializes the read-modify-write of the archive across worker processes
+    with open(directory / '.archive.lock', 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def archive_snapshot(path):
+    """Add the samples of the worker snapshot at ``path`` to the archive and remove the snapshot."""
+    # Claim the file first, so that of several processes archiving it at once only one merges it
+    claimed = path.with_name(f'.{path.stem}.{uuid.uuid4().hex}.dead')
+    try:
+        os.rename(path, claimed)
+    except FileNotFoundError:
+        return
+    try:
+        snapshot = json.loads(claimed.read_text())
+    except (OSError, ValueError):
+        snapshot = {}
+    archive = path.with_name(ARCHIVE_NAME)
+    with archive_lock(path.parent):
+        try:
+            archived = json.loads(archive.read_text())
+        except FileNotFoundError:
+            archived = {}
+        totals = sum_snapshots([archived, snapshot])
+        tmp = path.with_name(f'.{ARCHIVE_NAME}.tmp')
+        tmp.write_text(json.dumps({
+            name: [[list(labels), value] for labels, value in samples.items()]
+            for name, samples in totals.items()
+        }))
+        os.replace(tmp, archive)
+    claimed.unlink()
+
+
+def pid_alive(pid):
+    if os.name != 'posix':
+        return True  # os.kill(pid, 0) would terminate the process on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # another user's process
+    return True
+
+
+def mark_process_dead(pid):
+    """Archive the snapshot of worker ``pid`` right away, e.g. from gunicorn's ``child_exit`` hook."""
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if directory:
+        archive_snapshot(Path(directory) / f'{pid}.json')
+
+
+def clear_worker_snapshots():
+    """Drop every snapshot and the archive, e.g. from gunicorn's ``on_starting`` hook before workers
+    start: a restarted server starts its counters from zero, which Prometheus reads as a restart.
+    """
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if directory:
+        for path in Path(directory).glob('*.json'):
+            path.unlink(missing_ok=True)
+
+
+def _label_text(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry
+        self.samples = {}
+        registry.register(self)
+
+    def inc(self, *labels, amount=1):
+        self.registry.reset_after_fork()
+        with self.registry.lock:
+            self.samples[labels] = self.samples.get(labels, 0.0) + amount
+
+    def render(self, samples):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in sorted(samples.items()):
+            yield f'{self.name}{_label_text(self.labelnames, labels)} {value}'
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.registry = registry
+        # label values => [count per bucket..., count above the last bucket, sum]
+        self.samples = {}
+        registry.register(self)
+
+    def observe(self, value, *labels):
+        self.registry.reset_after_fork()
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self.registry.lock:
+            sample = self.samples.get(labels)
+            if sample is None:
+                sample = self.samples[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            sample[index] += 1
+            sample[-1] += value
+
+    def render(self, samples):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, sample in sorted(samples.items()):
+            cumulative = 0
+            for bound, count in zip([*self.buckets, '+Inf'], sample[:-1]):
+                cumulative += count
+                yield f'{self.name}_bucket{_label_text(self.labelnames, labels, [("le", bound)])} {cumulative}'
+            yield f'{self.name}_sum{_label_text(self.labelnames, labels)} {sample[-1]}'
+            yield f'{self.name}_count{_label_text(self.labelnames, labels)} {cumulative}'
+
+
+REQUEST_DURATION = Histogram(
+    'blogrepost_request_duration_seconds', 'Time to serve a request, by URL name', ['view'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUEST_QUERIES = Histogram(
+    'blogrepost_request_queries', 'SQL queries run by a request, by URL name', ['view'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100),
+)
+BOOKINGS = Counter(
+    'blogrepost_bookings_total', 'Booking attempts by entry point and outcome', ['source', 'outcome'],
+)
+CACHE_LOOKUPS = Counter(
+    'blogrepost_cache_lookups_total', 'Cache lookups by cache and result (hit or miss)', ['cache', 'result'],
+)
+
+
+def cache_hit_ratios(totals):
+    lookups = {}
+    for (cache_name, result), value in totals.get(CACHE_LOOKUPS.name, {}).items():
+        hits_misses = lookups.setdefault(cache_name, [0.0, 0.0])
+        hits_misses[result != 'hit'] += value
+    return {cache_name: hits / (hits + misses) for cache_name, (hits, misses) in lookups.items() if hits + misses}
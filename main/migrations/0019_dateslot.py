@@ -0,0 +1,64 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:39
+
+from datetime import date, timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def forwards(apps, schema_editor):
+    BlogRequest = apps.get_model('main', 'BlogRequest')
+    DateSlot = apps.get_model('main', 'DateSlot')
+    for br in BlogRequest.objects.iterator():
+        unavailable = set()
+        for value in br.unavailable_dates or []:
+            try:
+                unavailable.add(date.fromisoformat(str(value).strip()))
+            except ValueError:
+                continue
+        days = (br.available_to - br.available_from).days + 1
+        DateSlot.objects.bulk_create([
+            DateSlot(
+                request=br,
+                date=br.available_from + timedelta(days=offset),
+                is_unavailable=br.available_from + timedelta(days=offset) in unavailable,
+            )
+            for offset in range(max(days, 0))
+        ])
+
+
+def backwards(apps, schema_editor):
+    BlogRequest = apps.get_model('main', 'BlogRequest')
+    DateSlot = apps.get_model('main', 'DateSlot')
+    for br in BlogRequest.objects.iterator():
+        dates = DateSlot.objects.filter(request=br, is_unavailable=True).order_by('date').values_list('date', flat=True)
+        br.unavailable_dates = [d.strftime('%Y-%m-%d') for d in dates]
+        br.save(update_fields=['unavailable_dates'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_alter_userprofile_subscribers_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DateSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('is_unavailable', models.BooleanField(default=False, verbose_name='Недоступна')),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='main.blogrequest')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('is_unavailable', False)), fields=['date', 'request'], name='dateslot_open_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('request', 'date'), name='unique_slot_per_request_date')],
+            },
+        ),
+        migrations.RunPython(forwards, backwards),
+        migrations.RemoveField(
+            model_name='blogrequest',
+            name='unavailable_dates',
+        ),
+    ]
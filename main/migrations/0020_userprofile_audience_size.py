@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:40
+
+from django.db import migrations, models
+
+# Lower bound of each subscribers_count range at the time of this migration
+AUDIENCE_BY_GROUPSIZE = {
+    'size1': 0,
+    'size2': 100,
+    'size3': 500,
+    'size4': 1000,
+}
+
+
+def backfill_audience_size(apps, schema_editor):
+    UserProfile = apps.get_model('main', 'UserProfile')
+    for code, audience_size in AUDIENCE_BY_GROUPSIZE.items():
+        UserProfile.objects.filter(subscribers_count=code).update(audience_size=audience_size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0019_dateslot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='audience_size',
+            field=models.PositiveIntegerField(blank=True, db_index=True, editable=False, null=True, verbose_name='Размер аудитории'),
+        ),
+        migrations.RunPython(backfill_audience_size, migrations.RunPython.noop),
+    ]
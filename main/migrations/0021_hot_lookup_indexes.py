@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0020_userprofile_audience_size'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='blogrequest',
+            index=models.Index(fields=['user', '-start_date'], name='blogrequest_user_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='blogrequest',
+            index=models.Index(fields=['-start_date', '-id'], name='blogrequest_start_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='savedrequest',
+            index=models.Index(fields=['request', '-created_at'], name='savedrequest_req_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='savedrequest',
+            index=models.Index(condition=models.Q(('share_due_date__isnull', False)), fields=['share_due_date', 'request'], name='savedrequest_due_date_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:45
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_acceptance_count(apps, schema_editor):
+    BlogRequest = apps.get_model('main', 'BlogRequest')
+    SavedRequest = apps.get_model('main', 'SavedRequest')
+    counts = SavedRequest.objects.filter(request=OuterRef('pk')).order_by() \
+        .values('request').annotate(n=Count('pk')).values('n')
+    BlogRequest.objects.update(acceptance_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0021_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blogrequest',
+            name='acceptance_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Откликов'),
+        ),
+        migrations.RunPython(backfill_acceptance_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0022_blogrequest_acceptance_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('affinity', models.SmallIntegerField(default=0)),
+                ('score', models.SmallIntegerField(default=0)),
+                ('request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='match_scores', to='main.blogrequest')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='match_scores', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-score', '-request'], name='matchscore_user_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'request'), name='unique_match_score_per_user_request')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0023_matchscore'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='blogrequest',
+            index=models.Index(fields=['available_to'], name='blogrequest_available_to_idx'),
+        ),
+    ]
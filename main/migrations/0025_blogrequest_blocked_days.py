@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:52
+
+from django.db import migrations, models
+
+
+def backfill_blocked_days(apps, schema_editor):
+    BlogRequest = apps.get_model('main', 'BlogRequest')
+    DateSlot = apps.get_model('main', 'DateSlot')
+    SavedRequest = apps.get_model('main', 'SavedRequest')
+    for br in BlogRequest.objects.iterator():
+        blocked = set(DateSlot.objects.filter(request=br, is_unavailable=True).values_list('date', flat=True))
+        blocked |= set(SavedRequest.objects.filter(request=br, share_due_date__isnull=False)
+                       .values_list('share_due_date', flat=True))
+        bits = 0
+        for day in blocked:
+            offset = (day - br.available_from).days
+            if offset >= 0:
+                bits |= 1 << offset
+        br.blocked_days = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+        br.save(update_fields=['blocked_days'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0024_blogrequest_available_to_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blogrequest',
+            name='blocked_days',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RunPython(backfill_blocked_days, migrations.RunPython.noop),
+    ]
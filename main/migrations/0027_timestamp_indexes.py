@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 13:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0026_blogrequest_updated_at_userprofile_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='savedrequest',
+            index=models.Index(fields=['created_at'], name='savedrequest_created_idx'),
+        ),
+    ]
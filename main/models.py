@@ -1,7 +1,16 @@
-from django.db import models
+from collections import Counter
+from datetime import date, timedelta
+
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.backends.signals import connection_created
+from django.db.models import Count, Exists, F, Func, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
+
+from .availability import DayBitmap
 
 # This model extends Django's built-in User model to add extra fields.
 
@@ -12,6 +21,14 @@ GROUPSIZE_CHOICES = [
     ('size4', '>1000'),
 ]
 
+# Subscriber range [low, high) covered by each group size code
+GROUPSIZE_RANGES = {
+    'size1': (0, 100),
+    'size2': (100, 500),
+    'size3': (500, 1000),
+    'size4': (1000, 1000000),
+}
+
 GENRE_CHOICES = [
     ('genre1', 'Жанр 1'),
     ('genre2', 'Жанр 2'),
@@ -26,14 +43,99 @@ class UserProfile(models.Model):
     litnet_link = models.URLField(max_length=500, blank=True, verbose_name="Страница автора на Литнет")
     vk_link = models.URLField(max_length=500, blank=True, verbose_name="Страница автора VK")
     subscribers_count = models.CharField(blank=True, choices=GROUPSIZE_CHOICES, verbose_name="Количество подписчиков")
+    # Lower bound of the subscribers_count range, kept in sync on save for indexed range filters
+    audience_size = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True,
+                                                verbose_name="Размер аудитории")
     genres = models.CharField(max_length=50, choices=GENRE_CHOICES, blank=True, verbose_name="Жанры автора")
     telegram_nickname = models.CharField(max_length=100, blank=True)
 
     balance = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, verbose_name="Баланс")
+    # Part of the cache keys of request cards showing this profile (main.card_cache) and of page ETags (main.conditional)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
+    def save(self, *args, **kwargs):
+        low_high = GROUPSIZE_RANGES.get(self.subscribers_count)
+        self.audience_size = low_high[0] if low_high else None
+        update_fields = kwargs.get('update_fields')
+        if update_fields:
+            # auto_now only applies to the saved fields
+            kwargs['update_fields'] = {*update_fields, 'updated_at'}
+            if 'subscribers_count' in update_fields:
+                kwargs['update_fields'].add('audience_size')
+        super().save(*args, **kwargs)
+
+
+class SetDayBit(Func):
+    """``blocked_days`` with the bit of ``day`` set to ``value`` (0 or 1), relative to ``available_from``."""
+    function = 'set_day_bit'
+    output_field = models.BinaryField()
+
+    def __init__(self, day, value):
+        super().__init__(F('blocked_days'), F('available_from'), Value(day, models.DateField()), value)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        # set_bit numbers the bits of a bytea like DayBitmap, from the lowest bit of the first byte;
+        # the value is padded with zero bytes up to the day's byte first
+        (bits, bits_params), (origin, _), (day, day_params), (value, value_params) = [
+            compiler.compile(expression) for expression in self.get_source_expressions()
+        ]
+        offset = f'({day} - {origin})'
+        sql = (f"CASE WHEN {offset} < 0 THEN {bits} "
+               f"ELSE set_bit({bits} || decode(repeat('00', {offset} / 8 + 1 - length({bits})), 'hex'), "
+               f"{offset}, {value}) END")
+        params = (*day_params, *bits_params, *bits_params, *day_params, *bits_params, *day_params, *value_params)
+        return sql, params
+
+
+def _set_day_bit(data, origin, day, value):
+    bitmap = DayBitmap.from_bytes(date.fromisoformat(origin), data)
+    bitmap.set(date.fromisoformat(day), bool(value))
+    return bitmap.to_bytes()
+
+
+@receiver(connection_created)
+def register_sqlite_functions(sender, connection, **kwargs):
+    # SQLite has no bit functions for blobs, so SetDayBit runs this Python version there
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function('set_day_bit', 4, _set_day_bit, deterministic=True)
+
+
+class BlogRequestQuerySet(models.QuerySet):
+    def with_free_slot(self, date_from, date_to):
+        """Requests that still have a bookable day between date_from and date_to (inclusive)."""
+        taken = SavedRequest.objects.filter(request=OuterRef('request'), share_due_date=OuterRef('date'))
+        free_slots = DateSlot.objects.filter(
+            request=OuterRef('pk'),
+            date__range=(date_from, date_to),
+            is_unavailable=False,
+        ).filter(~Exists(taken))
+        return self.filter(Exists(free_slots))
+
+    def recount_acceptances(self):
+        # Re-derive the denormalized acceptance_count of every request in this queryset in one UPDATE
+        counts = SavedRequest.objects.filter(request=OuterRef('pk')).order_by() \
+            .values('request').annotate(n=Count('pk')).values('n')
+        return self.update(acceptance_count=Coalesce(Subquery(counts), 0))
+
+    def count_booking(self, day, booked):
+        # A booking due on ``day`` (or None) was added or removed: acceptance_count and the day's bit
+        # in blocked_days change in one UPDATE, instead of a refresh_blocked_days rebuild. A freed day
+        # stays blocked while its slot is marked unavailable.
+        if booked:
+            changes = {'acceptance_count': F('acceptance_count') + 1}
+            value = Value(1)
+        else:
+            changes = {'acceptance_count': Greatest(F('acceptance_count') - 1, 0)}
+            unavailable = DateSlot.objects.filter(request=OuterRef('pk'), date=day, is_unavailable=True)
+            value = Cast(Exists(unavailable), models.IntegerField())
+        if day is not None:
+            # Free days show on the request's pages, so this counts as a modification
+            changes.update(blocked_days=SetDayBit(day, value), updated_at=timezone.now())
+        return self.update(**changes)
+
 
 class BlogRequest(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -45,18 +147,125 @@ class BlogRequest(models.Model):
     available_from = models.DateField(verbose_name="Можно начать с")
     available_to = models.DateField(verbose_name="Можно закончить по")
     date_created = models.DateField(auto_now_add=True)
+    # Number of SavedRequest rows, maintained by the SavedRequest signals below
+    acceptance_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Откликов")
+    # DayBitmap of unavailable and taken days relative to available_from, see refresh_blocked_days
+    blocked_days = models.BinaryField(default=b'', editable=False)
+    # Part of the cache keys of this request's cards (main.card_cache) and of page ETags (main.conditional)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BlogRequestQuerySet.as_manager()
 
-    unavailable_dates = models.JSONField(default=list, blank=True, verbose_name="Недоступные даты (для этой заявки)")
+    class Meta:
+        indexes = [
+            # "My requests" listings: filter by owner, newest start first
+            models.Index(fields=['user', '-start_date'], name='blogrequest_user_start_idx'),
+            # Available requests feed: keyset pagination on (start_date, id)
+            models.Index(fields=['-start_date', '-id'], name='blogrequest_start_id_idx'),
+            # Open requests (window not over yet) for availability and match scoring
+            models.Index(fields=['available_to'], name='blogrequest_available_to_idx'),
+        ]
 
     def __str__(self):
         return self.book_name
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields:
+            # auto_now only applies to the saved fields
+            kwargs['update_fields'] = {*update_fields, 'updated_at'}
+        super().save(*args, **kwargs)
+
+    def sync_date_slots(self):
+        # Keep exactly one DateSlot per day of the available_from..available_to window
+        self.slots.exclude(date__range=(self.available_from, self.available_to)).delete()
+        existing = set(self.slots.values_list('date', flat=True))
+        days = (self.available_to - self.available_from).days + 1
+        DateSlot.objects.bulk_create([
+            DateSlot(request=self, date=self.available_from + timedelta(days=offset))
+            for offset in range(max(days, 0))
+            if self.available_from + timedelta(days=offset) not in existing
+        ])
+
+    def set_unavailable_dates(self, dates):
+        self.slots.filter(date__in=dates).update(is_unavailable=True)
+        self.slots.exclude(date__in=dates).filter(is_unavailable=True).update(is_unavailable=False)
+        self.refresh_blocked_days()
+
+    def blocked_dates(self):
+        # Days of the window that cannot be booked: marked unavailable or already taken
+        unavailable = self.slots.filter(is_unavailable=True).values_list('date', flat=True)
+        taken = self.saves.filter(share_due_date__isnull=False).values_list('share_due_date', flat=True)
+        return unavailable.union(taken)
+
+    @property
+    def blocked_bitmap(self):
+        return DayBitmap.from_bytes(self.available_from, self.blocked_days)
+
+    def refresh_blocked_days(self):
+        # Rebuild the stored bitmap from slots and bookings; the row lock orders the rebuild with the
+        # single-day UPDATEs of concurrent bookings (count_booking)
+        with transaction.atomic():
+            available_from = BlogRequest.objects.select_for_update().filter(pk=self.pk) \
+                .values_list('available_from', flat=True).first()
+            if available_from is None:
+                return
+            self.blocked_days = DayBitmap.from_dates(available_from, self.blocked_dates()).to_bytes()
+            # Free days show on the request's pages, so this counts as a modification
+            self.updated_at = timezone.now()
+            BlogRequest.objects.filter(pk=self.pk).update(blocked_days=self.blocked_days, updated_at=self.updated_at)
+
+
+class DateSlot(models.Model):
+    request = models.ForeignKey(BlogRequest, on_delete=models.CASCADE, related_name='slots')
+    date = models.DateField(verbose_name="Дата")
+    is_unavailable = models.BooleanField(default=False, verbose_name="Недоступна")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['request', 'date'],
+                name='unique_slot_per_request_date'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['date', 'request'],
+                condition=models.Q(is_unavailable=False),
+                name='dateslot_open_date_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.request} — {self.date}"
+
+class SavedRequestQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create sends no post_save, so keep BlogRequest.acceptance_count in step here
+        created = super().bulk_create(objs, *args, **kwargs)
+        request_ids = [obj.request_id for obj in created]
+        if kwargs.get('ignore_conflicts') or kwargs.get('update_conflicts'):
+            # Which rows were actually inserted is unknown, so recount the touched requests
+            BlogRequest.objects.filter(pk__in=set(request_ids)).recount_acceptances()
+        else:
+            for request_id, n in Counter(request_ids).items():
+                BlogRequest.objects.filter(pk=request_id).update(acceptance_count=F('acceptance_count') + n)
+        for request_id in set(request_ids):
+            BlogRequest(pk=request_id).refresh_blocked_days()
+        # Nor do the match scores get their points refreshed by main.matching's handlers
+        from .matching import refresh_points_on_commit
+        refresh_points_on_commit(request_ids)
+        return created
+
+
 class SavedRequest(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='saved_requests')
     request = models.ForeignKey('BlogRequest', on_delete=models.CASCADE, related_name='saves')
     created_at = models.DateTimeField(auto_now_add=True)
     share_due_date = models.DateField(null=True, blank=True, verbose_name="Дата когда нужно сделать репост")
 
+    objects = SavedRequestQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -68,9 +277,76 @@ class SavedRequest(models.Model):
                 name='unique_share_date_per_request'
             ),
         ]
+        indexes = [
+            # Acceptances of a request, newest first
+            models.Index(fields=['request', '-created_at'], name='savedrequest_req_created_idx'),
+            # Admin changelist: newest bookings first, by date hierarchy
+            models.Index(fields=['created_at'], name='savedrequest_created_idx'),
+            # Calendar lookups by due date; undated saves are never queried by date
+            models.Index(
+                fields=['share_due_date', 'request'],
+                condition=models.Q(share_due_date__isnull=False),
+                name='savedrequest_due_date_idx',
+            ),
+        ]
+
+
+class MatchScore(models.Model):
+    # How well an open request suits a reposter; maintained by main.matching
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='match_scores')
+    request = models.ForeignKey(BlogRequest, on_delete=models.CASCADE, related_name='match_scores')
+    # Genre and audience-size part, depends only on the two profiles
+    affinity = models.SmallIntegerField(default=0)
+    # affinity plus the request's free-slot and urgency points
+    score = models.SmallIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'request'],
+                name='unique_match_score_per_user_request'
+            ),
+        ]
+        indexes = [
+            # Ranked available requests: one user's rows, best first, id as keyset tie-breaker
+            models.Index(fields=['user', '-score', '-request'], name='matchscore_user_score_idx'),
+        ]
 
 
 @receiver(post_save, sender=User)
 def create_profile_for_new_user(sender, instance, created, **kwargs):
     if created and not hasattr(instance, 'profile'):
         UserProfile.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=BlogRequest)
+def sync_blog_request_slots(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields is None or {'available_from', 'available_to'} & set(update_fields):
+        instance.sync_date_slots()
+        instance.refresh_blocked_days()
+
+
+def deleted_with_request(origin):
+    """Whether a post_delete of SavedRequest rows comes from deleting their BlogRequest: whatever the
+    handlers would keep in step on that request is being deleted too. ``origin`` is the instance or
+    queryset whose delete() cascaded, as passed to post_delete.
+    """
+    if isinstance(origin, models.QuerySet):
+        return origin.model is BlogRequest
+    return isinstance(origin, BlogRequest)
+
+
+@receiver(post_save, sender=SavedRequest)
+def count_new_booking(sender, instance, created, **kwargs):
+    if created:
+        BlogRequest.objects.filter(pk=instance.request_id).count_booking(instance.share_due_date, booked=True)
+    else:
+        # The due date may have moved
+        BlogRequest(pk=instance.request_id).refresh_blocked_days()
+
+
+@receiver(post_delete, sender=SavedRequest)
+def count_cancelled_booking(sender, instance, origin=None, **kwargs):
+    # Also runs for other cascades and QuerySet.delete(), which send post_delete per row
+    if not deleted_with_request(origin):
+        BlogRequest.objects.filter(pk=instance.request_id).count_booking(instance.share_due_date, booked=False)
@@ -0,0 +1,189 @@
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+from .metrics import REGISTRY, REQUEST_DURATION, REQUEST_QUERIES
+
+logger = logging.getLogger(__name__)
+
+# Profile of the request being handled in this thread or task, None outside ProfilingMiddleware
+current_profile = ContextVar('current_profile', default=None)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.view_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.sql_time = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper() on every database connection
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.sql_time += elapsed
+            self.queries.append({
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'ms': round(elapsed * 1000, 3),
+            })
+
+    def server_timing(self, total):
+        # https://www.w3.org/TR/server-timing/ - durations in milliseconds
+        return ', '.join([
+            f'total;dur={total * 1000:.1f}',
+            f'view;dur={self.view_time * 1000:.1f}',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'sql;dur={self.sql_time * 1000:.1f};desc="{len(self.queries)} queries"',
+        ])
+
+
+class ProfiledTemplate:
+    def __init__(self, backend_template):
+        self.backend_template = backend_template
+
+    @property
+    def origin(self):
+        return self.backend_template.origin
+
+    @property
+    def template(self):
+        return self.backend_template.template
+
+    def render(self, context=None, request=None):
+        profile = current_profile.get()
+        if profile is None:
+            return self.backend_template.render(context, request)
+        # Templates rendered from inside another one are already part of its time
+        profile.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return self.backend_template.render(context, request)
+        finally:
+            profile.template_depth -= 1
+            if not profile.template_depth:
+                profile.template_time += time.perf_counter() - started
+
+
+class ProfiledDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates backend whose templates add their render time to the current request profile."""
+
+    def from_string(self, template_code):
+        return ProfiledTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return ProfiledTemplate(super().get_template(template_name))
+
+
+class ProfilingMiddleware:
+    """Server-Timing header with total, view, template and SQL time for every response.
+
+    The total time and query count also feed the per-URL-name histograms of main.metrics.
+
+    Requests slower than PROFILING_SLOW_REQUEST_MS are logged to ``main.profiling`` as one JSON
+    object with the view name and every query, for a PROFILING_SLOW_SAMPLE_RATE share of them.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            with self.wrap_connections(profile):
+                response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            # Connections belong to the thread that runs this request's ORM calls, so the
+            # wrappers are installed and removed there
+            wrappers = await sync_to_async(self.wrap_connections)(profile)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(wrappers.close)()
+        finally:
+            current_profile.reset(token)
+        return self.finish(request, response, profile)
+
+    @staticmethod
+    def wrap_connections(profile):
+        # Installs the profile on every connection of the current thread; closing the stack removes it
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(profile))
+        return stack
+
+    def finish(self, request, response, profile):
+        now = time.perf_counter()
+        total = now - profile.started
+        if profile.view_started is not None:
+            profile.view_time = now - profile.view_started
+        response['Server-Timing'] = profile.server_timing(total)
+
+        view_name = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+        REQUEST_DURATION.observe(total, view_name)
+        REQUEST_QUERIES.observe(len(profile.queries), view_name)
+        REGISTRY.maybe_flush()
+
+        if (total * 1000 >= getattr(settings, 'PROFILING_SLOW_REQUEST_MS', 500)
+                and random.random() < getattr(settings, 'PROFILING_SLOW_SAMPLE_RATE', 1.0)):
+            self.log_slow_request(request, response, profile, total)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Runs after URL resolution and the earlier middleware, right before the view
+        profile = current_profile.get()
+        if profile is not None:
+            profile.view_started = time.perf_counter()
+
+    @staticmethod
+    def view_path(func):
+        # Class-based views resolve to an as_view() closure; report the class instead
+        func = getattr(func, 'view_class', func)
+        return f'{func.__module__}.{func.__qualname__}'
+
+    def log_slow_request(self, request, response, profile, total):
+        match = request.resolver_match
+        logger.warning(json.dumps({
+            'event': 'slow_request',
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'view_name': match.view_name if match else None,
+            'view': self.view_path(match.func) if match else None,
+            'total_ms': round(total * 1000, 3),
+            'view_ms': round(profile.view_time * 1000, 3),
+            'template_ms': round(profile.template_time * 1000, 3),
+            'sql_ms': round(profile.sql_time * 1000, 3),
+            'query_count': len(profile.queries),
+            'queries': profile.queries,
+        }, ensure_ascii=False))
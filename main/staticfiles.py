@@ -0,0 +1,239 @@
+import gzip
+import mimetypes
+import os
+from functools import partial
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core import checks
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:  # .br variants are skipped without the Brotli package
+    brotli = None
+
+# Text formats worth storing precompressed; images are compressed already
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.json', '.map', '.svg', '.txt', '.xml')
+# Content-Encoding => suffix of the precompressed variant, in order of preference
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+# Cache lifetime of fingerprinted files, whose content never changes under the same name
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+# Cache lifetime of files requested by their plain name, e.g. by old cached pages
+PLAIN_MAX_AGE = 60
+# Bytes read per worker thread hop when streaming a file under ASGI, as ASGIHandler chunks bodies
+ASYNC_BLOCK_SIZE = 2 ** 16
+
+
+class BundleFinder(finders.BaseFinder):
+    """Finds the stylesheets of STATIC_BUNDLES, each the concatenation of its source files.
+
+    Bundles are written to STATIC_BUNDLES_DIR whenever they are looked up or listed, so the
+    development server serves current ones and collectstatic collects them like any other file.
+    """
+
+    # Finders are instantiated once per process; settings are read on use, so tests can override them
+    @property
+    def bundles(self):
+        return getattr(settings, 'STATIC_BUNDLES', {})
+
+    @property
+    def storage(self):
+        return FileSystemStorage(location=getattr(settings, 'STATIC_BUNDLES_DIR', None))
+
+    def check(self, **kwargs):
+        return [
+            checks.Error(f"Source '{source}' of static bundle '{name}' was not found.", id='main.E001')
+            for name, sources in self.bundles.items()
+            for source in sources
+            if not finders.find(source)
+        ]
+
+    def build(self, name):
+        parts = []
+        for source in self.bundles[name]:
+            with open(finders.find(source), 'rb') as source_file:
+                parts.append(b'/* ' + source.encode() + b' */\n' + source_file.read().rstrip() + b'\n')
+        content = b'\n'.join(parts)
+        path = Path(self.storage.path(name))
+        # Rewritten only on change, so the file keeps its mtime for the development server's 304s
+        if not path.exists() or path.read_bytes() != content:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(content)
+        return str(path)
+
+    def find(self, path, find_all=False, **kwargs):
+        if path not in self.bundles:
+            return [] if find_all else None
+        found = self.build(path)
+        return [found] if find_all else found
+
+    def list(self, ignore_patterns):
+        for name in self.bundles:
+            self.build(name)
+            yield name, self.storage
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage that also writes a .gz and a .br next to every text file it collects.
+
+    With DEBUG on, files keep their plain names until the first collectstatic.
+    """
+
+    def stored_name(self, name):
+        # Without DEBUG a missing manifest raises, as in ManifestStaticFilesStorage: plain names
+        # would be served as if fingerprinted, cached for a year
+        if not self.hashed_files and settings.DEBUG:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in {*paths, *self.hashed_files.values()}:
+            if name.endswith(COMPRESSIBLE_EXTENSIONS) and self.exists(name):
+                self.compress(name)
+
+    def compress(self, name):
+        with self.open(name) as original:
+            content = original.read()
+        variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(content)
+        for suffix, compressed in variants.items():
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            # A variant that saves nothing would only cost the client a decompression
+            if len(compressed) < len(content):
+                self._save(name + suffix, ContentFile(compressed))
+
+
+class StaticFile:
+    def __init__(self, path, immutable):
+        self.path = path
+        self.immutable = immutable
+        stat = os.stat(path)
+        self.last_modified = int(stat.st_mtime)
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.encodings = {
+            encoding: path + suffix for encoding, suffix in ENCODINGS.items() if os.path.exists(path + suffix)
+        }
+        # Size of every variant, so only a GET's body touches the file
+        self.sizes = {variant: os.path.getsize(variant) for variant in [path, *self.encodings.values()]}
+
+    def response(self, request, asynchronous=False):
+        not_modified = get_conditional_response(request, last_modified=self.last_modified)
+        if not_modified is not None:
+            response = not_modified
+        else:
+            accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+            encoding = next((encoding for encoding in self.encodings if encoding in accepted), None)
+            path = self.encodings[encoding] if encoding else self.path
+            if request.method == 'HEAD':
+                response = HttpResponse(content_type=self.content_type)
+            elif asynchronous:
+                response = StreamingHttpResponse(read_in_threads(path), content_type=self.content_type)
+            else:
+                # Streamed by the WSGI server, with sendfile where it has wsgi.file_wrapper
+                response = FileResponse(open(path, 'rb'), content_type=self.content_type,
+                                        filename=os.path.basename(self.path))
+            response['Content-Length'] = self.sizes[path]
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['Last-Modified'] = http_date(self.last_modified)
+        if self.encodings:
+            response['Vary'] = 'Accept-Encoding'
+        if self.immutable:
+            response['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+        else:
+            response['Cache-Control'] = f'public, max-age={PLAIN_MAX_AGE}'
+        return response
+
+
+async def read_in_threads(path):
+    # A file's blocks for an async response; the blocking reads run off the event loop
+    in_thread = partial(sync_to_async, thread_sensitive=False)
+    static_file = await in_thread(open)(path, 'rb')
+    try:
+        while block := await in_thread(static_file.read)(ASYNC_BLOCK_SIZE):
+            yield block
+    finally:
+        await in_thread(static_file.close)()
+
+
+def accepted_encodings(header):
+    # Content codings of an Accept-Encoding header, without the ones refused with q=0
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticFilesMiddleware:
+    """Serves STATIC_ROOT from the Django process, for deployments without a web server in front.
+
+    Clients get the brotli or gzip variant written by collectstatic when they accept it, and
+    fingerprinted names are cached for a year. Files are indexed on the first request, so a new
+    collectstatic needs a restart, as a deploy does anyway.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+        if not settings.STATIC_ROOT or not self.prefix.startswith('/'):
+            raise MiddlewareNotUsed
+        self.files = None
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        static_file = self.find(request)
+        if static_file is not None:
+            return static_file.response(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        # The first lookup walks STATIC_ROOT, which is no work for the event loop
+        if self.files is None:
+            static_file = await sync_to_async(self.find, thread_sensitive=False)(request)
+        else:
+            static_file = self.find(request)
+        if static_file is not None:
+            return static_file.response(request, asynchronous=True)
+        return await self.get_response(request)
+
+    def find(self, request):
+        if request.method not in ('GET', 'HEAD') or not request.path_info.startswith(self.prefix):
+            return None
+        if self.files is None:
+            self.files = self.index()
+        return self.files.get(request.path_info[len(self.prefix):])
+
+    @staticmethod
+    def index():
+        # {name relative to STATIC_ROOT: StaticFile} of every collected file but the compressed variants
+        root = Path(settings.STATIC_ROOT)
+        hashed_names = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+        files = {}
+        for path in root.rglob('*'):
+            if path.is_file() and path.suffix not in ENCODINGS.values():
+                name = path.relative_to(root).as_posix()
+                files[name] = StaticFile(str(path), immutable=name in hashed_names)
+        return files
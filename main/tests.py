@@ -1,3 +1,1498 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+from contextlib import ExitStack
+from datetime import date, timedelta
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.contrib.staticfiles import finders
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import (
+    AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature,
+)
+from django.template.loader import render_to_string
+from django.templatetags.static import static
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import async_views, views
+from .availability import DayBitmap, compute_free_slots
+from .benchmark import seed, staff_rights, urlconf
+from .calendar_cache import calendar_version_key, get_calendar
+from .card_cache import CSRF_PLACEHOLDER
+from .db_router import PIN_COOKIE, PrimaryReplicaRouter, ReplicaPinningMiddleware, RequestRouting, current_routing
+from .matching import FREE_SLOT_POINTS, rebuild_all, refresh_request_points, refresh_requests, refresh_user
+from .metrics import (
+    BOOKINGS, CACHE_LOOKUPS, REGISTRY, REQUEST_DURATION, Counter, Registry, clear_worker_snapshots, mark_process_dead,
+)
+from .models import BlogRequest, MatchScore, SavedRequest, UserProfile
+from .staticfiles import CompressedManifestStaticFilesStorage
+
+# Keep tests away from the shared file cache and metrics directory used by the dev server
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'fragments': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'fragments'},
+    'sessions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'sessions'},
+}
+# Tests run with DEBUG off and, but for StaticPipelineTests, without a collectstatic manifest
+PLAIN_STORAGES = {
+    **settings.STORAGES,
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+isolated = override_settings(CACHES=LOCMEM_CACHES, STORAGES=PLAIN_STORAGES, METRICS_DIR=None)
+
+
+def clear_caches():
+    cache.clear()
+    caches['fragments'].clear()
+
+
+@isolated
+class IsolatedTestCase(TestCase):
+    pass
+
+
+@isolated
+class IsolatedTransactionTestCase(TransactionTestCase):
+    pass
+
+
+def make_request(owner, available_from, available_to, book_name='Book', start_date=None):
+    return BlogRequest.objects.create(
+        user=owner,
+        book_name=book_name,
+        author_page_link='https://example.com/book',
+        litnet_link='https://litnet.com/author',
+        vk_link='https://vk.com/author',
+        start_date=start_date or available_from,
+        available_from=available_from,
+        available_to=available_to,
+    )
+
+
+def seed_marketplace(users=12, requests_per_user=5, saves_per_request=3):
+    # Small but non-trivial dataset: every user owns requests and books other users' requests
+    today = date.today()
+    owners = [User.objects.create_user(f'user{i}', password='pass') for i in range(users)]
+    for i, owner in enumerate(owners):
+        owner.profile.genres = f'genre{i % 4 + 1}'
+        owner.profile.subscribers_count = f'size{i % 4 + 1}'
+        owner.profile.save()
+
+    blog_requests = []
+    for i, owner in enumerate(owners):
+        for j in range(requests_per_user):
+            blog_requests.append(make_request(owner, today, today + timedelta(days=30), f'Book {i}-{j}',
+                                              start_date=today + timedelta(days=j)))
+
+    for n, br in enumerate(blog_requests):
+        for k in range(saves_per_request):
+            reposter = owners[(owners.index(br.user) + k + 1) % users]
+            SavedRequest.objects.create(user=reposter, request=br, share_due_date=date.today() + timedelta(days=k + n % 5))
+    return owners, blog_requests
+
+
+class QueryPlanTests(IsolatedTestCase):
+    """Hot view queries on main_* tables must be answered from indexes, never full table scans."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Match scores are written once the seeding commits
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.users, cls.blog_requests = seed_marketplace()
+        cls.user = cls.users[0]
+        cls.own_request = cls.blog_requests[0]
+        cls.other_request = cls.blog_requests[-1]
+
+    def setUp(self):
+        clear_caches()
+        self.client.force_login(self.user)
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Tiny test tables make seq scans cheapest; only fall back to them without an index
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql)
+            else:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [' '.join(str(col) for col in row) for row in cursor.fetchall()]
+
+    def full_scans(self, plan):
+        if connection.vendor == 'postgresql':
+            return [line for line in plan if re.search(r'Seq Scan on main_', line)]
+        # SQLite reports "SCAN <table>" for full scans and "SCAN <table> USING INDEX" for ordered index walks
+        return [line for line in plan
+                if re.search(r'\bSCAN (?!CONSTANT ROW)\w+$', line.strip())]
+
+    def assertNoFullScans(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, data or {})
+        self.assertLess(response.status_code, 400)
+
+        failures = []
+        for query in ctx.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT') or 'main_' not in sql:
+                continue
+            scans = self.full_scans(self.explain(sql))
+            if scans:
+                failures.append(f'{sql}\n    -> {scans}')
+        if failures:
+            self.fail(f'Full table scans for {url}:\n' + '\n'.join(failures))
+
+    def test_home(self):
+        self.assertNoFullScans('get', reverse('home'))
+
+    def test_calendar_dates(self):
+        self.assertNoFullScans('get', reverse('calendar_dates'), {'month': date.today().strftime('%Y-%m')})
+
+    def test_available_requests(self):
+        self.assertNoFullScans('get', reverse('available_requests'))
+
+    def test_available_requests_ranked(self):
+        self.assertNoFullScans('get', reverse('available_requests'), {'sort': 'match'})
+
+    def test_available_requests_by_earliest_free_date(self):
+        self.assertNoFullScans('get', reverse('available_requests'), {'sort': 'earliest'})
+
+    def test_available_requests_filtered(self):
+        self.assertNoFullScans('get', reverse('available_requests'), {'genre': 'genre2', 'groupsize': 'size2'})
+
+    def test_available_requests_feed(self):
+        cursor = f'{self.other_request.start_date:%Y-%m-%d}_{self.other_request.id}'
+        self.assertNoFullScans('get', reverse('available_requests_feed'), {'cursor': cursor})
+
+    def test_request_availability(self):
+        self.assertNoFullScans('get', reverse('request_availability', args=[self.other_request.id]))
+
+    def test_show_requests(self):
+        self.assertNoFullScans('get', reverse('requests'))
+
+    def test_request_details(self):
+        self.assertNoFullScans('get', reverse('request_details', args=[self.own_request.id]))
+
+    def test_public_profile(self):
+        self.assertNoFullScans('get', reverse('public_profile', args=[self.other_request.user.id]))
+
+    def test_toggle_save_request(self):
+        free_day = self.other_request.available_to
+        self.assertNoFullScans('post', reverse('toggle-save-request', args=[self.other_request.id]),
+                               {'share_due_date': free_day.strftime('%Y-%m-%d')})
+
+
+class DateSlotTests(IsolatedTestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='pass')
+        self.reposter = User.objects.create_user('reposter', password='pass')
+        self.blog_request = make_request(self.owner, date(2030, 1, 1), date(2030, 1, 10), start_date=date(2030, 1, 10))
+
+    def has_free_slot(self, date_from, date_to):
+        return BlogRequest.objects.with_free_slot(date_from, date_to).filter(pk=self.blog_request.pk).exists()
+
+    def test_with_free_slot_skips_unavailable_and_taken_days(self):
+        self.blog_request.set_unavailable_dates([date(2030, 1, 5)])
+        SavedRequest.objects.create(user=self.reposter, request=self.blog_request, share_due_date=date(2030, 1, 6))
+
+        self.assertFalse(self.has_free_slot(date(2030, 1, 5), date(2030, 1, 6)))
+        self.assertTrue(self.has_free_slot(date(2030, 1, 5), date(2030, 1, 7)))
+        self.assertTrue(self.has_free_slot(date(2030, 1, 4), date(2030, 1, 4)))
+        # Outside the window there are no slots at all
+        self.assertFalse(self.has_free_slot(date(2030, 1, 11), date(2030, 1, 20)))
+
+    def test_with_free_slot_follows_window_changes(self):
+        self.blog_request.available_to = date(2030, 1, 20)
+        self.blog_request.save(update_fields=['available_to'])
+        self.assertTrue(self.has_free_slot(date(2030, 1, 11), date(2030, 1, 20)))
+
+        self.blog_request.available_from = date(2030, 1, 15)
+        self.blog_request.save(update_fields=['available_from'])
+        self.assertFalse(self.has_free_slot(date(2030, 1, 1), date(2030, 1, 14)))
+
+    def test_create_form_marks_unavailable_dates(self):
+        self.client.force_login(self.owner)
+        response = self.client.post(reverse('request'), {
+            'book_name': 'New book',
+            'author_page_link': 'https://example.com/new',
+            'start_date': '2030-02-01',
+            'available_from': '2030-02-01',
+            'available_to': '2030-02-05',
+            'unavailable_dates': '2030-02-02, 2030-02-04',
+        })
+        self.assertRedirects(response, reverse('requests'), fetch_redirect_response=False)
+        blog_request = BlogRequest.objects.get(book_name='New book')
+        self.assertEqual(sorted(blog_request.blocked_dates()), [date(2030, 2, 2), date(2030, 2, 4)])
+        self.assertEqual(blog_request.blocked_bitmap.ranges(), [(date(2030, 2, 2),) * 2, (date(2030, 2, 4),) * 2])
+
+
+JANUARY_2030 = (date(2030, 1, 1), date(2030, 1, 31))
+
+
+class CalendarCacheTests(IsolatedTestCase):
+    def setUp(self):
+        clear_caches()
+        self.owner = User.objects.create_user('owner', password='pass')
+        self.reposter = User.objects.create_user('reposter', password='pass')
+        self.blog_request = make_request(self.owner, date(2030, 1, 1), date(2030, 1, 31), start_date=date(2030, 1, 10))
+
+    def test_cached_calendar_is_reused(self):
+        get_calendar(self.owner, *JANUARY_2030)
+        with self.assertNumQueries(0):
+            get_calendar(self.owner, *JANUARY_2030)
+
+    def test_saving_and_deleting_a_booking_invalidates_both_calendars(self):
+        self.assertEqual(get_calendar(self.reposter, *JANUARY_2030)['action_dates'], [])
+        self.assertEqual(get_calendar(self.owner, *JANUARY_2030)['request_due_map'], {})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            saved = SavedRequest.objects.create(user=self.reposter, request=self.blog_request,
+                                                share_due_date=date(2030, 1, 5))
+        self.assertEqual(get_calendar(self.reposter, *JANUARY_2030)['action_dates'], ['2030-01-10'])
+        self.assertEqual(get_calendar(self.owner, *JANUARY_2030)['request_due_map'], {'2030-01-05': self.blog_request.id})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            saved.delete()
+        self.assertEqual(get_calendar(self.reposter, *JANUARY_2030)['action_dates'], [])
+        self.assertEqual(get_calendar(self.owner, *JANUARY_2030)['request_due_map'], {})
+
+    def test_start_date_change_invalidates_reposters(self):
+        SavedRequest.objects.create(user=self.reposter, request=self.blog_request, share_due_date=date(2030, 1, 5))
+        get_calendar(self.reposter, *JANUARY_2030)
+
+        self.blog_request.start_date = date(2030, 1, 20)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.blog_request.save(update_fields=['start_date'])
+        self.assertEqual(get_calendar(self.reposter, *JANUARY_2030)['action_dates'], ['2030-01-20'])
+
+    def test_deleting_request_invalidates_owner(self):
+        SavedRequest.objects.create(user=self.reposter, request=self.blog_request, share_due_date=date(2030, 1, 5))
+        get_calendar(self.owner, *JANUARY_2030)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.blog_request.delete()
+        self.assertEqual(get_calendar(self.owner, *JANUARY_2030)['request_due_map'], {})
+
+    @override_settings(CACHES={**LOCMEM_CACHES, 'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'small-fragments',
+        'OPTIONS': {'MAX_ENTRIES': 2, 'CULL_FREQUENCY': 1},
+    }})
+    def test_culled_windows_keep_the_version(self):
+        get_calendar(self.owner, *JANUARY_2030)
+        version = cache.get(calendar_version_key(self.owner.pk))
+        for month in range(2, 7):
+            get_calendar(self.owner, date(2030, month, 1), date(2030, month, 28))
+        self.assertEqual(cache.get(calendar_version_key(self.owner.pk)), version)
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_rebuilds_read_from_the_primary(self):
+        SavedRequest.objects.create(user=self.reposter, request=self.blog_request, share_due_date=date(2030, 1, 5))
+        # Never routed, so never sent to a replica that may not have the invalidating commit yet
+        with patch.object(PrimaryReplicaRouter, 'db_for_read', side_effect=AssertionError('routed read')):
+            calendar = get_calendar(self.owner, *JANUARY_2030)
+        self.assertEqual(calendar['request_due_map'], {'2030-01-05': self.blog_request.id})
+
+    def test_invalidation_waits_for_the_commit(self):
+        get_calendar(self.owner, *JANUARY_2030)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            SavedRequest.objects.create(user=self.reposter, request=self.blog_request, share_due_date=date(2030, 1, 5))
+            # A reader inside the transaction's lifetime keeps the committed calendar and caches nothing new
+            self.assertEqual(get_calendar(self.owner, *JANUARY_2030)['request_due_map'], {})
+        self.assertEqual(get_calendar(self.owner, *JANUARY_2030)['request_due_map'], {'2030-01-05': self.blog_request.id})
+
+    def test_calendar_endpoint_returns_only_the_requested_month(self):
+        SavedRequest.objects.create(user=self.reposter, request=self.blog_request, share_due_date=date(2030, 1, 5))
+        SavedRequest.objects.create(user=User.objects.create_user('late', password='pass'),
+                                    request=self.blog_request, share_due_date=date(2030, 2, 5))
+        self.client.force_login(self.owner)
+
+        response = self.client.get(reverse('calendar_dates'), {'month': '2030-02'})
+        self.assertEqual(response.json(), {'action_dates': [], 'request_due_map': {'2030-02-05': self.blog_request.id}})
+
+        response = self.client.get(reverse('calendar_dates'), {'start': '2030-01-01', 'end': '2031-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_calendar_endpoint_rejects_bad_ranges(self):
+        self.client.force_login(self.owner)
+        for params in [
+            {'month': '2030-13'},
+            {'month': 'январь'},
+            {},
+            {'start': '2030-01-01'},
+            {'start': '2030-01-01', 'end': '2030-02-30'},
+            {'start': '2030-02-01', 'end': '2030-01-31'},
+            {'start': '2030-01-01', 'end': '2030-04-04'},
+        ]:
+            with self.subTest(params=params):
+                response = self.client.get(reverse('calendar_dates'), params)
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.json()['success'])
+
+        # The longest range served is CALENDAR_MAX_DAYS days past the start
+        response = self.client.get(reverse('calendar_dates'), {'start': '2030-01-01', 'end': '2030-04-03'})
+        self.assertEqual(response.status_code, 200)
+
+
+class AcceptanceCountTests(IsolatedTestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='pass')
+        self.reposters = [User.objects.create_user(f'reposter{i}', password='pass') for i in range(3)]
+        self.blog_request = make_request(self.owner, date(2030, 1, 1), date(2030, 1, 31), start_date=date(2030, 1, 10))
+
+    def assertAcceptanceCount(self, expected):
+        self.blog_request.refresh_from_db(fields=['acceptance_count'])
+        self.assertEqual(self.blog_request.acceptance_count, expected)
+
+    def test_create_delete_and_cascade(self):
+        saved = SavedRequest.objects.create(user=self.reposters[0], request=self.blog_request,
+                                            share_due_date=date(2030, 1, 2))
+        SavedRequest.objects.create(user=self.reposters[1], request=self.blog_request, share_due_date=date(2030, 1, 3))
+        self.assertAcceptanceCount(2)
+
+        saved.delete()
+        self.assertAcceptanceCount(1)
+
+        self.reposters[1].delete()
+        self.assertAcceptanceCount(0)
+
+    def test_bulk_create_and_queryset_delete(self):
+        SavedRequest.objects.bulk_create([
+            SavedRequest(user=reposter, request=self.blog_request, share_due_date=date(2030, 1, 2 + i))
+            for i, reposter in enumerate(self.reposters)
+        ])
+        self.assertAcceptanceCount(3)
+
+        SavedRequest.objects.filter(user__in=self.reposters[:2]).delete()
+        self.assertAcceptanceCount(1)
+
+    def test_recount_command_repairs_drift(self):
+        SavedRequest.objects.create(user=self.reposters[0], request=self.blog_request, share_due_date=date(2030, 1, 2))
+        BlogRequest.objects.update(acceptance_count=42)
+
+        call_command('recount_acceptances', stdout=StringIO())
+        self.assertAcceptanceCount(1)
+
+
+class BookingQueryTests(IsolatedTestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner', password='pass')
+        self.reposter = User.objects.create_user('reposter', password='pass')
+        today = date.today()
+        self.blog_request = make_request(owner, today, today + timedelta(days=10))
+        self.day = today + timedelta(days=2)
+        self.client.force_login(self.reposter)
+
+    def test_booking_is_one_insert_and_one_update(self):
+        url = reverse('toggle-save-request', args=[self.blog_request.pk])
+        # The user, the request, then INSERT and one UPDATE of acceptance_count and blocked_days in a
+        # savepoint; the match scores are shifted after the commit by a SELECT and an UPDATE
+        with self.assertNumQueries(8), self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.post(url, {'share_due_date': self.day.isoformat()})
+        self.assertEqual(response.status_code, 302)
+        guarded = [query['sql'].split()[0] for query in captured.captured_queries][2:6]
+        self.assertEqual(guarded, ['SAVEPOINT', 'INSERT', 'UPDATE', 'RELEASE'])
+
+        self.blog_request.refresh_from_db()
+        self.assertEqual(self.blog_request.acceptance_count, 1)
+        self.assertIn(self.day, self.blog_request.blocked_bitmap)
+
+
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class ConcurrentBookingTests(IsolatedTransactionTestCase):
+    """Parallel bookings of one slot: exactly one wins, the rest get a clean "date taken" redirect."""
+
+    bookers = 8
+
+    def setUp(self):
+        owner = User.objects.create_user('owner', password='pass')
+        self.users = [User.objects.create_user(f'booker{i}', password='pass') for i in range(self.bookers)]
+        today = date.today()
+        self.blog_request = make_request(owner, today, today + timedelta(days=10))
+        self.slot = today + timedelta(days=5)
+
+    def book(self, user, barrier, results):
+        client = Client()
+        client.force_login(user)
+        barrier.wait()
+        try:
+            response = client.post(reverse('toggle-save-request', args=[self.blog_request.id]),
+                                   {'share_due_date': self.slot.strftime('%Y-%m-%d')})
+            results.append(response.status_code)
+        finally:
+            connection.close()
+
+    def test_parallel_bookings_of_one_slot(self):
+        barrier = threading.Barrier(self.bookers)
+        results = []
+        threads = [threading.Thread(target=self.book, args=(user, barrier, results)) for user in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [302] * self.bookers)
+        self.assertEqual(SavedRequest.objects.filter(request=self.blog_request, share_due_date=self.slot).count(), 1)
+        self.blog_request.refresh_from_db()
+        self.assertEqual(self.blog_request.acceptance_count, 1)
+
+
+class BatchBookingTests(IsolatedTestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='pass')
+        self.reposter = User.objects.create_user('reposter', password='pass')
+        self.other = User.objects.create_user('other', password='pass')
+        today = date.today()
+        self.first, self.second, self.own = [
+            make_request(user, today, today + timedelta(days=10), f'Book {i}')
+            for i, user in enumerate([self.owner, self.owner, self.reposter])
+        ]
+        self.day = today + timedelta(days=3)
+        SavedRequest.objects.create(user=self.other, request=self.second, share_due_date=self.day)
+        self.client.force_login(self.reposter)
+
+    def book(self, bookings):
+        return self.client.post(reverse('book_requests'), {'bookings': bookings}, content_type='application/json')
+
+    def test_per_item_results(self):
+        day = self.day.strftime('%Y-%m-%d')
+        next_day = (self.day + timedelta(days=1)).strftime('%Y-%m-%d')
+        response = self.book([
+            {'request': self.first.id, 'date': day},
+            {'request': self.first.id, 'date': next_day},
+            {'request': self.second.id, 'date': day},
+            {'request': self.own.id, 'date': day},
+            {'request': self.second.id, 'date': '2000-01-01'},
+            {'request': 'x', 'date': day},
+        ])
+
+        results = response.json()['results']
+        self.assertEqual([r['success'] for r in results], [True, False, False, False, False, False])
+        self.assertEqual(results[1]['error'], 'Вы уже откликнулись на эту заявку.')
+        self.assertEqual(results[2]['error'], 'Этот день уже занят для этой заявки.')
+        self.assertEqual(results[3]['error'], 'Заявка не найдена')
+        self.assertEqual(results[4]['error'], 'Эта дата недоступна для выбора.')
+        self.assertEqual(results[5]['error'], 'Неверный формат данных')
+
+        self.assertTrue(SavedRequest.objects.filter(user=self.reposter, request=self.first, share_due_date=self.day).exists())
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.acceptance_count, 1)
+
+    def test_rejects_oversized_batches(self):
+        response = self.book([{'request': self.first.id, 'date': '2030-01-01'}] * 51)
+        self.assertEqual(response.status_code, 400)
+
+
+class MatchScoreTests(IsolatedTestCase):
+    """Scores are written after the commit, so every write here runs its on_commit callbacks."""
+
+    def setUp(self):
+        self.reposter = User.objects.create_user('reposter', password='pass')
+        self.reposter.profile.genres = 'genre1'
+        self.reposter.profile.subscribers_count = 'size2'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.reposter.profile.save()
+
+        today = date.today()
+        self.requests = {}
+        for name, genres, groupsize in [('match', 'genre1', 'size2'), ('near', 'genre2', 'size3'), ('far', 'genre3', 'size4')]:
+            owner = User.objects.create_user(name, password='pass')
+            owner.profile.genres = genres
+            owner.profile.subscribers_count = groupsize
+            with self.captureOnCommitCallbacks(execute=True):
+                owner.profile.save()
+                self.requests[name] = make_request(owner, today, today + timedelta(days=30), name)
+        self.client.force_login(self.reposter)
+
+    def score(self, blog_request):
+        return MatchScore.objects.get(user=self.reposter, request=blog_request).score
+
+    def ranked_names(self):
+        response = self.client.get(reverse('available_requests'), {'sort': 'match'})
+        return [req.book_name for req in response.context['requests']]
+
+    def test_ranked_by_genre_and_audience(self):
+        self.assertEqual(self.ranked_names(), ['match', 'near', 'far'])
+
+    def test_profile_change_rescores(self):
+        self.reposter.profile.genres = 'genre3'
+        self.reposter.profile.subscribers_count = 'size4'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.reposter.profile.save()
+        self.assertEqual(self.ranked_names(), ['far', 'near', 'match'])
+
+    def test_bookings_shift_request_points(self):
+        blog_request = self.requests['match']
+        blog_request.available_to = date.today() + timedelta(days=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            blog_request.save(update_fields=['available_to'])
+        before = self.score(blog_request)
+
+        other = User.objects.create_user('other', password='pass')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            saved = SavedRequest.objects.create(user=other, request=blog_request, share_due_date=date.today())
+            # Nothing is rescored under the booking's transaction
+            self.assertEqual(self.score(blog_request), before)
+        self.assertTrue(callbacks)
+        self.assertEqual(self.score(blog_request), before - FREE_SLOT_POINTS)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            saved.delete()
+        self.assertEqual(self.score(blog_request), before)
+
+    def test_batch_bookings_shift_request_points(self):
+        blog_request = self.requests['match']
+        blog_request.available_to = date.today() + timedelta(days=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            blog_request.save(update_fields=['available_to'])
+        before = self.score(blog_request)
+
+        client = Client()
+        with self.captureOnCommitCallbacks(execute=True):
+            client.force_login(User.objects.create_user('other', password='pass'))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(reverse('book_requests'), {'bookings': [
+                {'request': blog_request.id, 'date': date.today().isoformat()},
+                {'request': self.requests['near'].id, 'date': date.today().isoformat()},
+            ]}, content_type='application/json')
+        self.assertEqual([r['success'] for r in response.json()['results']], [True, True])
+        self.assertEqual(self.score(blog_request), before - FREE_SLOT_POINTS)
+
+        # Same scores as a full recompute
+        scores = set(MatchScore.objects.values_list('user', 'request', 'score'))
+        call_command('rebuild_match_scores', stdout=StringIO())
+        self.assertEqual(set(MatchScore.objects.values_list('user', 'request', 'score')), scores)
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_rescoring_reads_from_the_primary(self):
+        blog_request = self.requests['match']
+        routed = set()
+        with patch.object(PrimaryReplicaRouter, 'db_for_read',
+                          side_effect=lambda model, **hints: routed.add(model) or 'default'):
+            refresh_request_points(blog_request.pk)
+            refresh_requests([blog_request.pk])
+            refresh_user(self.reposter.pk)
+            rebuild_all()
+        # MatchScore is only asked for by bulk_create's feature checks, which run no query
+        self.assertEqual(routed - {MatchScore}, set())
+
+    def test_rebuild_command_is_idempotent(self):
+        scores = set(MatchScore.objects.values_list('user', 'request', 'score'))
+        call_command('rebuild_match_scores', stdout=StringIO())
+        self.assertEqual(set(MatchScore.objects.values_list('user', 'request', 'score')), scores)
+
+
+class BlockedDaysTests(IsolatedTestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='pass')
+        self.reposters = [User.objects.create_user(f'reposter{i}', password='pass') for i in range(3)]
+        self.blog_request = make_request(self.owner, date(2030, 1, 1), date(2030, 1, 31))
+
+    def assertMatchesRebuild(self, *expected):
+        # The single-day UPDATEs leave what refresh_blocked_days would store
+        self.blog_request.refresh_from_db()
+        rebuilt = DayBitmap.from_dates(self.blog_request.available_from, self.blog_request.blocked_dates())
+        self.assertEqual(bytes(self.blog_request.blocked_days), rebuilt.to_bytes())
+        self.assertEqual([first for first, _ in self.blog_request.blocked_bitmap.ranges()], list(expected))
+
+    def test_bookings_set_and_clear_their_day(self):
+        first = SavedRequest.objects.create(user=self.reposters[0], request=self.blog_request,
+                                            share_due_date=date(2030, 1, 3))
+        last = SavedRequest.objects.create(user=self.reposters[1], request=self.blog_request,
+                                           share_due_date=date(2030, 1, 31))
+        SavedRequest.objects.create(user=self.reposters[2], request=self.blog_request, share_due_date=None)
+        self.assertMatchesRebuild(date(2030, 1, 3), date(2030, 1, 31))
+
+        last.delete()
+        self.assertMatchesRebuild(date(2030, 1, 3))
+
+        # A freed day its owner marked unavailable meanwhile stays blocked
+        self.blog_request.set_unavailable_dates([date(2030, 1, 3)])
+        first.delete()
+        self.assertMatchesRebuild(date(2030, 1, 3))
+
+    def test_deleting_a_request_skips_the_per_booking_handlers(self):
+        def delete_queries(saves):
+            blog_request = make_request(self.owner, date(2030, 1, 1), date(2030, 1, 31))
+            for i, reposter in enumerate(self.reposters[:saves]):
+                SavedRequest.objects.create(user=reposter, request=blog_request, share_due_date=date(2030, 1, 2 + i))
+            with CaptureQueriesContext(connection) as captured, self.captureOnCommitCallbacks(execute=True):
+                blog_request.delete()
+            return [query['sql'] for query in captured.captured_queries]
+
+        one, three = delete_queries(1), delete_queries(3)
+        self.assertEqual(len(one), len(three), '\n'.join(three))
+        self.assertFalse([sql for sql in three if sql.startswith('UPDATE')])
+
+
+class FreeSlotCalculatorTests(IsolatedTestCase):
+    def test_earliest_free_date_and_count(self):
+        owner = User.objects.create_user('owner', password='pass')
+        reposter = User.objects.create_user('reposter', password='pass')
+        today = date.today()
+        blog_request = make_request(owner, today - timedelta(days=5), today + timedelta(days=4), start_date=today)
+        blog_request.set_unavailable_dates([today, today + timedelta(days=2)])
+        SavedRequest.objects.create(user=reposter, request=blog_request, share_due_date=today + timedelta(days=1))
+
+        blog_request.refresh_from_db()
+        with self.assertNumQueries(0):
+            result = compute_free_slots([
+                (blog_request.id, blog_request.available_from, blog_request.available_to, blog_request.blocked_days),
+                (0, today - timedelta(days=10), today - timedelta(days=1), b''),
+            ])
+        self.assertEqual(result[blog_request.id], (today + timedelta(days=3), 2))
+        self.assertEqual(result[0], (None, 0))
+
+        # The stored bitmap follows bookings and is served to the datepicker as ranges
+        client = Client()
+        client.force_login(reposter)
+        response = client.get(reverse('request_availability', args=[blog_request.id]))
+        self.assertEqual(response.json()['blocked_ranges'], [
+            {'from': today.isoformat(), 'to': (today + timedelta(days=2)).isoformat()},
+        ])
+        SavedRequest.objects.get(user=reposter).delete()
+        blog_request.refresh_from_db()
+        self.assertNotIn(today + timedelta(days=1), blog_request.blocked_bitmap)
+        self.assertIn(today + timedelta(days=2), blog_request.blocked_bitmap)
+
+
+class DayBitmapTests(SimpleTestCase):
+    origin = date(2030, 1, 1)
+
+    def bitmap(self, *days):
+        # Round-trips through the stored form, as BlogRequest.blocked_bitmap does
+        data = DayBitmap.from_dates(self.origin, [self.origin + timedelta(days=day) for day in days]).to_bytes()
+        return DayBitmap.from_bytes(self.origin, data)
+
+    def day(self, offset):
+        return self.origin + timedelta(days=offset)
+
+    def test_empty(self):
+        self.assertEqual(DayBitmap.from_dates(self.origin, []).to_bytes(), b'')
+        self.assertEqual(DayBitmap.from_bytes(self.origin, b'').ranges(), [])
+        self.assertEqual(DayBitmap.from_bytes(self.origin, None).ranges(), [])
+        self.assertNotIn(self.origin, DayBitmap.from_bytes(self.origin, b''))
+
+    def test_single_day(self):
+        self.assertEqual(self.bitmap(4).ranges(), [(self.day(4), self.day(4))])
+
+    def test_range_at_the_start_of_the_window(self):
+        self.assertEqual(self.bitmap(0, 1, 2, 6).ranges(), [(self.day(0), self.day(2)), (self.day(6), self.day(6))])
+
+    def test_range_at_the_end_of_the_window(self):
+        # Across a byte boundary, up to the last stored bit
+        bitmap = self.bitmap(3, 6, 7, 8, 9)
+        self.assertEqual(bitmap.ranges(), [(self.day(3), self.day(3)), (self.day(6), self.day(9))])
+        self.assertIn(self.day(9), bitmap)
+        self.assertNotIn(self.day(10), bitmap)
+
+    def test_set_and_clear_single_days(self):
+        bitmap = self.bitmap(2)
+        bitmap.set(self.day(20))
+        bitmap.set(self.day(-1))
+        self.assertEqual(bitmap.ranges(), [(self.day(2), self.day(2)), (self.day(20), self.day(20))])
+        bitmap.set(self.day(20), blocked=False)
+        bitmap.set(self.day(30), blocked=False)
+        self.assertEqual(bitmap.to_bytes(), self.bitmap(2).to_bytes())
+
+    def test_days_before_the_origin_are_ignored(self):
+        bitmap = DayBitmap.from_dates(self.origin, [self.day(-1), self.day(0)])
+        self.assertEqual(bitmap.ranges(), [(self.day(0), self.day(0))])
+        self.assertNotIn(self.day(-1), bitmap)
+
+
+class BenchmarkCommandTests(IsolatedTestCase):
+    def test_report_covers_every_view_and_rolls_back(self):
+        out = StringIO()
+        call_command('benchmark_views', users=8, requests=20, saves=40, repeat=2, output='-', stdout=out)
+        report = json.loads(out.getvalue())
+
+        self.assertEqual(report['meta']['scale']['requests'], 20)
+        self.assertTrue({'home', 'available_requests', 'show_requests', 'request_details',
+                         'toggle_save_request:book', 'admin:blogrequest_changelist'} <= set(report['views']))
+        for name, result in report['views'].items():
+            self.assertIn(result['status'], (200, 302), name)
+            self.assertGreater(result['queries'], 0, name)
+            self.assertLessEqual(result['wall_ms']['min'], result['wall_ms']['median'])
+        self.assertEqual(report['views']['admin:blogrequest_changelist']['status'], 200)
+        self.assertFalse(User.objects.exists())
+
+    def test_report_file_is_followed_by_a_summary(self):
+        report_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(report_dir.cleanup)
+        output = os.path.join(report_dir.name, 'report.json')
+        out = StringIO()
+        call_command('benchmark_views', users=4, requests=8, saves=8, repeat=1, output=output, stdout=out)
+        with open(output, encoding='utf-8') as report_file:
+            views = json.load(report_file)['views']
+        lines = out.getvalue().splitlines()
+        self.assertEqual(sorted(line.split()[0] for line in lines[:-1]), sorted(views))
+        self.assertEqual(lines[-1], f'Wrote {output}.')
+
+    def test_seeded_accounts_cannot_log_in_or_reach_the_admin(self):
+        viewer, _ = seed(users=4, requests=4, saves=4)
+        with staff_rights(viewer):
+            self.assertTrue(User.objects.get(pk=viewer.pk).is_superuser)
+        accounts = User.objects.filter(username__startswith=viewer.username.rsplit('-', 1)[0])
+        self.assertEqual(accounts.count(), 4)
+        for account in accounts:
+            self.assertFalse(account.has_usable_password())
+            self.assertFalse(account.is_staff or account.is_superuser)
+
+    def test_committing_benchmarks_need_an_explicit_opt_in(self):
+        for command in ('benchmark_async', 'benchmark_connections'):
+            with self.assertRaisesMessage(CommandError, '--commit'):
+                call_command(command, users=2, requests=2, saves=0, stdout=StringIO())
+        self.assertFalse(User.objects.exists())
+
+    def test_seed_keeps_blocked_days_consistent_with_slots(self):
+        _, blog_requests = seed(users=8, requests=20, saves=40)
+        blocked = 0
+        for br in BlogRequest.objects.filter(pk__in=[br.pk for br in blog_requests]):
+            expected = DayBitmap.from_dates(br.available_from, br.blocked_dates()).to_bytes()
+            self.assertEqual(bytes(br.blocked_days), expected, br.book_name)
+            blocked += bool(expected)
+        self.assertGreater(blocked, 0)
+
+
+class QueryBudgetTests(IsolatedTestCase):
+    """Every view in main/urls.py must run as many queries on a large dataset as on a small one.
+
+    A view whose count grows with the data (a lazy ``req.user.profile`` in a template, a per-row
+    count in a loop) fails here with the SQL of both runs.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        today = date.today()
+        cls.viewer = User.objects.create_user('viewer', password='pass')
+        cls.staff = User.objects.create_user('staff', password='pass', is_staff=True)
+        cls.main_request = make_request(cls.viewer, today, today + timedelta(days=120), 'Main')
+        cls.next_day = 0
+        cls.owners = 0
+
+    def grow(self, owners):
+        # New owners with two requests each: one booked by the viewer, and each owner books the main request.
+        # Returns fresh targets for the write views, so both runs see the same per-object state.
+        today = date.today()
+        with self.captureOnCommitCallbacks(execute=True):
+            return self._grow(owners, today)
+
+    def _grow(self, owners, today):
+        new_owners = []
+        for _ in range(owners):
+            self.owners += 1
+            owner = User.objects.create_user(f'owner{self.owners}', password='pass')
+            new_owners.append(owner)
+            owner.profile.genres = 'genre1'
+            owner.profile.subscribers_count = 'size2'
+            owner.profile.save()
+            booked = make_request(owner, today, today + timedelta(days=30), f'Booked {self.owners}')
+            make_request(owner, today, today + timedelta(days=30), f'Open {self.owners}')
+            SavedRequest.objects.create(user=self.viewer, request=booked, share_due_date=today)
+            SavedRequest.objects.create(user=owner, request=self.main_request,
+                                        share_due_date=today + timedelta(days=self.next_day))
+            self.next_day += 1
+            make_request(self.viewer, today, today + timedelta(days=30), f'Own {self.owners}')
+
+        other = User.objects.create_user(f'owner{self.owners}-targets', password='pass')
+        # Deleting cascades to a booking per new owner
+        doomed = make_request(self.viewer, today, today + timedelta(days=30), 'Doomed')
+        for day, owner in enumerate([other, *new_owners]):
+            SavedRequest.objects.create(user=owner, request=doomed, share_due_date=today + timedelta(days=day))
+        return {
+            'toggle': make_request(other, today, today + timedelta(days=30), 'Toggle'),
+            'batch': [make_request(other, today, today + timedelta(days=30), f'Batch {i}') for i in range(2)],
+            'doomed': doomed,
+        }
+
+    def cases(self, targets):
+        # URL name (optionally ":variant") => zero-argument callable issuing the request
+        today = date.today().strftime('%Y-%m-%d')
+        client = self.client
+        anonymous = Client()
+        leaving = Client()
+        leaving.force_login(self.viewer)
+        staff = Client()
+        staff.force_login(self.staff)
+        toggle = reverse('toggle-save-request', args=[targets['toggle'].pk])
+        bookings = [{'request': br.pk, 'date': today} for br in targets['batch']]
+        return {
+            'home': lambda: client.get(reverse('home')),
+            'home:anonymous': lambda: anonymous.get(reverse('home')),
+            'calendar_dates': lambda: client.get(reverse('calendar_dates'), {'month': today[:7]}),
+            'profile': lambda: client.get(reverse('profile')),
+            'public_profile': lambda: client.get(reverse('public_profile', args=[self.viewer.pk])),
+            'request': lambda: client.get(reverse('request')),
+            'register': lambda: anonymous.get(reverse('register')),
+            'available_requests': lambda: client.get(reverse('available_requests')),
+            'available_requests:filtered': lambda: client.get(reverse('available_requests'),
+                                                              {'genre': 'genre1', 'groupsize': 'size2'}),
+            'available_requests:match': lambda: client.get(reverse('available_requests'), {'sort': 'match'}),
+            'available_requests:earliest': lambda: client.get(reverse('available_requests'), {'sort': 'earliest'}),
+            'available_requests_feed': lambda: client.get(reverse('available_requests_feed')),
+            'requests': lambda: client.get(reverse('requests')),
+            'request_details': lambda: client.get(reverse('request_details', args=[self.main_request.pk])),
+            'request_availability': lambda: client.get(reverse('request_availability',
+                                                               args=[self.main_request.pk])),
+            'toggle-save-request:book': lambda: client.post(toggle, {'share_due_date': today}),
+            'toggle-save-request:cancel': lambda: client.post(toggle),
+            'book_requests': lambda: client.post(reverse('book_requests'), json.dumps({'bookings': bookings}),
+                                                 content_type='application/json'),
+            'update_request': lambda: client.post(reverse('update_request', args=[self.main_request.pk]),
+                                                  json.dumps({'field': 'start_date', 'value': today}),
+                                                  content_type='application/json'),
+            'delete_request': lambda: client.post(reverse('delete_request', args=[targets['doomed'].pk])),
+            'metrics': lambda: staff.get(reverse('metrics')),
+            'login': lambda: anonymous.get(reverse('login')),
+            'logout': lambda: leaving.post(reverse('logout')),
+        }
+
+    def measure(self, targets):
+        queries = {}
+        for name, issue in self.cases(targets).items():
+            clear_caches()
+            # Queries deferred to the commit count too
+            with CaptureQueriesContext(connection) as captured, self.captureOnCommitCallbacks(execute=True):
+                response = issue()
+            self.assertLess(response.status_code, 400, name)
+            if response.get('Content-Type') == 'application/json':
+                # Measure the work, not an early error answer
+                body = response.json()
+                self.assertTrue(body.get('success', True), name)
+                self.assertTrue(all(result['success'] for result in body.get('results', [])), body)
+            queries[name] = [query['sql'] for query in captured.captured_queries]
+        return queries
+
+    def test_every_url_has_a_budget(self):
+        from .urls import urlpatterns
+        covered = {name.split(':')[0] for name in self.cases(self.grow(0))}
+        self.assertEqual({pattern.name for pattern in urlpatterns} - covered, set())
+
+    def test_query_counts_do_not_grow_with_data(self):
+        self.client.force_login(self.viewer)
+        small = self.measure(self.grow(2))
+        large = self.measure(self.grow(25))
+
+        failures = []
+        for name, small_queries in small.items():
+            if len(large[name]) != len(small_queries):
+                failures.append('\n'.join([
+                    f'{name}: {len(small_queries)} queries on the small dataset, {len(large[name])} on the large one',
+                    '  small:', *(f'    {sql}' for sql in small_queries),
+                    '  large:', *(f'    {sql}' for sql in large[name]),
+                ]))
+        if failures:
+            self.fail('\n\n'.join(failures))
+
+
+class ProfilingMiddlewareTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, cls.blog_requests = seed_marketplace(users=3, requests_per_user=2, saves_per_request=1)
+
+    def setUp(self):
+        self.client.force_login(self.users[0])
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('requests'))
+        metrics = dict(re.findall(r'(\w+);dur=([\d.]+)', response['Server-Timing']))
+        self.assertEqual(set(metrics), {'total', 'view', 'tpl', 'sql'})
+        self.assertGreater(float(metrics['tpl']), 0)
+        self.assertLessEqual(float(metrics['view']), float(metrics['total']))
+        self.assertRegex(response['Server-Timing'], r'sql;dur=[\d.]+;desc="[1-9]\d* queries"')
+
+    @override_settings(PROFILING_SLOW_REQUEST_MS=0)
+    def test_slow_request_is_logged_with_view_name_and_queries(self):
+        with self.assertLogs('main.profiling', 'WARNING') as logs, \
+                CaptureQueriesContext(connection) as captured:
+            self.client.get(reverse('requests'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view_name'], 'requests')
+        self.assertEqual(record['view'], 'main.views.show_requests')
+        self.assertEqual(record['query_count'], len(captured))
+        # Logged without parameters, so session keys and form values stay out of the log
+        self.assertTrue(any('main_blogrequest' in query['sql'] for query in record['queries']))
+        self.assertTrue(all('%s' in query['sql'] for query in record['queries'] if 'WHERE' in query['sql']))
+
+    def test_fast_requests_are_not_logged(self):
+        with self.assertNoLogs('main.profiling'):
+            self.client.get(reverse('home'))
+
+
+class MetricsTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, cls.blog_requests = seed_marketplace(users=3, requests_per_user=2, saves_per_request=0)
+        cls.staff = User.objects.create_user('staff', password='pass', is_staff=True)
+
+    def setUp(self):
+        metrics_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(metrics_dir.cleanup)
+        settings_override = override_settings(METRICS_DIR=metrics_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.metrics_dir = metrics_dir.name
+
+    def total(self, counter, *labels):
+        return REGISTRY.collect()[counter.name].get(labels, 0)
+
+    def test_booking_outcomes_are_counted(self):
+        blog_request = self.blog_requests[-1]
+        url = reverse('toggle-save-request', args=[blog_request.id])
+        day = date.today().strftime('%Y-%m-%d')
+        success = self.total(BOOKINGS, 'toggle', 'success')
+        conflict = self.total(BOOKINGS, 'toggle', 'conflict')
+
+        self.client.force_login(self.users[0])
+        self.client.post(url, {'share_due_date': day})
+        SavedRequest.objects.filter(user=self.users[0], request=blog_request).update(user=self.users[1])
+        with patch.object(BlogRequest, 'blocked_bitmap', DayBitmap(date.today())):
+            # A stale bitmap lets the second booking through to the unique constraint
+            self.client.post(url, {'share_due_date': day})
+
+        self.assertEqual(self.total(BOOKINGS, 'toggle', 'success'), success + 1)
+        self.assertEqual(self.total(BOOKINGS, 'toggle', 'conflict'), conflict + 1)
+
+    def test_endpoint_is_staff_only_and_prometheus_formatted(self):
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)
+
+        self.client.get(reverse('calendar_dates'), {'month': '2030-01'})
+        self.client.get(reverse('calendar_dates'), {'month': '2030-01'})
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE blogrepost_request_duration_seconds histogram', body)
+        self.assertRegex(body, r'blogrepost_request_duration_seconds_bucket\{view="calendar_dates",le="\+Inf"\} [1-9]')
+        self.assertRegex(body, r'blogrepost_request_queries_count\{view="calendar_dates"\} [1-9]')
+        self.assertRegex(body, r'blogrepost_cache_hit_ratio\{cache="calendar"\} 0\.\d+')
+
+    def test_worker_snapshots_are_summed(self):
+        before = REGISTRY.collect()[CACHE_LOOKUPS.name].get(('calendar', 'hit'), 0)
+        REGISTRY.flush()
+        with open(f'{self.metrics_dir}/{os.getpid()}.json') as own:
+            snapshot = json.load(own)
+        # Another gunicorn worker that has seen the same traffic
+        with open(f'{self.metrics_dir}/1.json', 'w') as other:
+            json.dump(snapshot, other)
+
+        CACHE_LOOKUPS.inc('calendar', 'hit', amount=3)
+        totals = REGISTRY.collect()
+        self.assertEqual(totals[CACHE_LOOKUPS.name][('calendar', 'hit')], 2 * before + 3)
+        for labels, sample in totals[REQUEST_DURATION.name].items():
+            self.assertEqual(sum(sample[:-1]) % 2, 0, labels)
+
+    @skipUnless(os.name == 'posix', 'worker liveness is only checked on POSIX')
+    def test_snapshots_of_exited_workers_are_archived(self):
+        worker = subprocess.Popen([sys.executable, '-c', ''])
+        worker.wait()
+        exited = f'{self.metrics_dir}/{worker.pid}.json'
+        with open(exited, 'w') as snapshot:
+            json.dump({CACHE_LOOKUPS.name: [[['calendar', 'exited'], 1000.0]]}, snapshot)
+
+        # Counted once, before and after the move into the archive, so the counter never goes down
+        self.assertEqual(self.total(CACHE_LOOKUPS, 'calendar', 'exited'), 1000)
+        self.assertFalse(os.path.exists(exited))
+        self.assertEqual(self.total(CACHE_LOOKUPS, 'calendar', 'exited'), 1000)
+
+    def test_worker_snapshots_can_be_archived_by_server_hooks(self):
+        before = REGISTRY.collect()[REQUEST_DURATION.name].get(('home',), [0])[0]
+        for pid in (1, 2):
+            with open(f'{self.metrics_dir}/{pid}.json', 'w') as other:
+                json.dump({REQUEST_DURATION.name: [[['home'], [1] + [0] * len(REQUEST_DURATION.buckets) + [0.5]]]},
+                          other)
+            mark_process_dead(pid)
+        mark_process_dead(2)
+
+        self.assertEqual(sorted(name for name in os.listdir(self.metrics_dir) if name.endswith('.json')),
+                         [f'{os.getpid()}.json', 'archive.json'])
+        # The repeated hook for worker 2 adds nothing
+        self.assertEqual(REGISTRY.collect()[REQUEST_DURATION.name][('home',)][0], before + 2)
+        clear_worker_snapshots()
+        self.assertEqual([name for name in os.listdir(self.metrics_dir) if name.endswith('.json')], [])
+
+    def test_reused_pid_keeps_the_exited_process_samples(self):
+        registry = Registry()
+        lookups = Counter('reused_lookups_total', 'Lookups', ['result'], registry=registry)
+        # Left by an exited process that had this pid
+        with open(f'{self.metrics_dir}/{os.getpid()}.json', 'w') as snapshot:
+            json.dump({lookups.name: [[['hit'], 5.0]]}, snapshot)
+
+        lookups.inc('hit')
+        self.assertEqual(registry.collect()[lookups.name][('hit',)], 6)
+        lookups.inc('hit')
+        self.assertEqual(registry.collect()[lookups.name][('hit',)], 7)
+
+    def test_concurrent_increments_are_not_lost(self):
+        before = self.total(CACHE_LOOKUPS, 'threads', 'hit')
+
+        def work():
+            for _ in range(1000):
+                CACHE_LOOKUPS.inc('threads', 'hit')
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.total(CACHE_LOOKUPS, 'threads', 'hit'), before + 8000)
+
+
+@override_settings(ROOT_URLCONF=urlconf(async_views))
+class AsyncViewTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, cls.blog_requests = seed_marketplace(users=4, requests_per_user=3, saves_per_request=2)
+        cls.user = cls.users[0]
+        cls.own_request = cls.blog_requests[0]
+
+    def pages(self):
+        return [
+            reverse('home'),
+            reverse('available_requests'),
+            reverse('available_requests') + '?sort=earliest',
+            reverse('available_requests') + '?sort=match&genre=genre2',
+            reverse('public_profile', args=[self.users[1].pk]),
+            reverse('request_details', args=[self.own_request.pk]),
+        ]
+
+    async def test_async_pages_match_sync_pages(self):
+        await self.async_client.aforce_login(self.user)
+        for url in self.pages():
+            async_response = await self.async_client.get(url)
+            with override_settings(ROOT_URLCONF=urlconf(views)):
+                sync_response = await self.async_client.get(url)
+            self.assertEqual(async_response.status_code, 200, url)
+            # Same page apart from the per-response CSRF token
+            csrf = re.compile(rb'name="csrfmiddlewaretoken" value="[^"]+"')
+            self.assertEqual(csrf.sub(b'', async_response.content), csrf.sub(b'', sync_response.content), url)
+
+    async def test_async_pages_are_profiled(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('request_details', args=[self.own_request.pk]))
+        self.assertRegex(response['Server-Timing'], r'sql;dur=[\d.]+;desc="[1-9]\d* queries"')
+
+    async def test_missing_and_foreign_objects_are_404(self):
+        await self.async_client.aforce_login(self.user)
+        other_request = self.blog_requests[-1]
+        self.assertEqual((await self.async_client.get(reverse('request_details', args=[other_request.pk]))).status_code, 404)
+        self.assertEqual((await self.async_client.get(reverse('public_profile', args=[0]))).status_code, 404)
+        await self.async_client.alogout()
+        response = await self.async_client.get(reverse('available_requests'))
+        self.assertEqual(response.status_code, 302)
+
+
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class SyncAsyncBenchmarkTests(IsolatedTransactionTestCase):
+    def test_both_sides_serve_every_request(self):
+        out = StringIO()
+        call_command('benchmark_async', users=6, requests=12, saves=20, concurrency=3, total=15, commit=True, stdout=out)
+        report = json.loads(out.getvalue())
+        for side in ('wsgi_sync', 'asgi_async'):
+            self.assertEqual(report[side]['requests'], 15)
+            self.assertEqual(report[side]['errors'], 0)
+        self.assertFalse(User.objects.exists())
+
+
+class CardCacheTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, cls.blog_requests = seed_marketplace(users=3, requests_per_user=2, saves_per_request=1)
+        cls.user = cls.users[0]
+
+    def setUp(self):
+        clear_caches()
+        self.client.force_login(self.user)
+
+    def rendered_cards(self, url):
+        with patch('main.card_cache.render_to_string', wraps=render_to_string) as rendered:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, rendered.call_count
+
+    def test_unchanged_cards_come_from_the_cache(self):
+        for url in (reverse('available_requests'), reverse('requests')):
+            _, first = self.rendered_cards(url)
+            _, second = self.rendered_cards(url)
+            self.assertGreater(first, 0, url)
+            self.assertEqual(second, 0, url)
+
+    def test_edits_rerender_only_the_affected_cards(self):
+        self.rendered_cards(reverse('available_requests'))
+        other_request = BlogRequest.objects.exclude(user=self.user).exclude(saves__user=self.user).first()
+        owner = other_request.user
+
+        other_request.book_name = 'Renamed book'
+        other_request.save(update_fields=['book_name'])
+        response, rendered = self.rendered_cards(reverse('available_requests'))
+        self.assertContains(response, 'Renamed book')
+        self.assertEqual(rendered, 1)
+
+        owner.profile.genres = 'genre3'
+        owner.profile.save(update_fields=['genres'])
+        response, rendered = self.rendered_cards(reverse('available_requests'))
+        self.assertContains(response, 'Жанр 3')
+        self.assertEqual(rendered, BlogRequest.objects.filter(user=owner).exclude(saves__user=self.user).count())
+
+    def test_owners_without_a_profile_still_get_cards(self):
+        UserProfile.objects.filter(user=self.users[1]).delete()
+        response, _ = self.rendered_cards(reverse('available_requests'))
+        self.assertContains(response, 'Book 1-0')
+
+    def test_cached_cards_carry_the_viewers_csrf_token(self):
+        reposter = Client(enforce_csrf_checks=True)
+        reposter.force_login(self.users[1])
+        reposter.get(reverse('available_requests'))
+        # The second page is assembled from cards cached by the first one
+        with patch('main.card_cache.render_to_string', wraps=render_to_string) as rendered:
+            response = reposter.get(reverse('available_requests'))
+        self.assertEqual(rendered.call_count, 0)
+        self.assertNotContains(response, CSRF_PLACEHOLDER)
+
+        blog_request = BlogRequest.objects.exclude(user=self.users[1]).exclude(saves__user=self.users[1]).first()
+        action = reverse('toggle-save-request', args=[blog_request.pk])
+        token = re.search(rf'action="{action}">\s*<input type="hidden" name="csrfmiddlewaretoken" value="([^"]+)"',
+                          response.content.decode())
+        response = reposter.post(action, {
+            'csrfmiddlewaretoken': token.group(1),
+            'share_due_date': (date.today() + timedelta(days=20)).strftime('%Y-%m-%d'),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(SavedRequest.objects.filter(user=self.users[1], request=blog_request).exists())
+
+
+class ConditionalGetTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, cls.blog_requests = seed_marketplace(users=3, requests_per_user=2, saves_per_request=1)
+        cls.user = cls.users[0]
+        cls.own_request = BlogRequest.objects.filter(user=cls.user).first()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def pages(self):
+        return [
+            reverse('public_profile', args=[self.users[1].pk]),
+            reverse('request_details', args=[self.own_request.pk]),
+            reverse('available_requests'),
+            reverse('available_requests') + '?sort=earliest',
+        ]
+
+    def etag(self, url, client=None):
+        client = client or self.client
+        client.get(url)
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return response['ETag']
+
+    def test_unchanged_pages_are_not_modified(self):
+        for read_views in (views, async_views):
+            with override_settings(ROOT_URLCONF=urlconf(read_views)):
+                for url in self.pages():
+                    # The first visit also sets the CSRF cookie the ETag depends on
+                    self.client.get(url)
+                    with CaptureQueriesContext(connection) as rendered:
+                        first = self.client.get(url)
+                    self.assertIn('Last-Modified', first, url)
+                    self.assertIn('private', first['Cache-Control'], url)
+                    with CaptureQueriesContext(connection) as revalidated:
+                        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+                    self.assertEqual(response.status_code, 304, url)
+                    self.assertEqual(response.content, b'', url)
+                    self.assertEqual(response.templates, [], url)
+                    self.assertLess(len(revalidated), len(rendered), url)
+
+    def test_changes_invalidate_the_pages_that_show_them(self):
+        profile_url, details_url, available_url, _ = self.pages()
+        etags = {url: self.etag(url) for url in (profile_url, details_url, available_url)}
+
+        # users[1] booked the viewer's request, so their profile also shows among its acceptances
+        profile = self.users[1].profile
+        profile.telegram_nickname = 'renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.save(update_fields=['telegram_nickname'])
+        responses = {url: self.client.get(url, HTTP_IF_NONE_MATCH=etag) for url, etag in etags.items()}
+        for url, response in responses.items():
+            self.assertEqual(response.status_code, 200, url)
+        self.assertContains(responses[profile_url], 'renamed')
+
+        etag = self.etag(details_url)
+        self.assertEqual(self.client.get(details_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        SavedRequest.objects.filter(request=self.own_request).delete()
+        self.assertEqual(self.client.get(details_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_available_requests_revalidate_from_the_cache(self):
+        url = reverse('available_requests')
+        etag = self.etag(url)
+        with CaptureQueriesContext(connection) as revalidated:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual([query['sql'] for query in revalidated if 'main_' in query['sql']], [])
+
+        # A booking anywhere changes the listing once it commits
+        blog_request = BlogRequest.objects.exclude(user=self.users[1]).exclude(saves__user=self.users[1]).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            SavedRequest.objects.create(user=self.users[1], request=blog_request, share_due_date=date.today())
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_validators_are_per_viewer(self):
+        url = reverse('public_profile', args=[self.users[1].pk])
+        etag = self.etag(url)
+        other = Client()
+        other.force_login(self.users[2])
+        self.assertEqual(other.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(other.get(url, HTTP_IF_NONE_MATCH=self.etag(url, other)).status_code, 304)
+
+    def test_pending_messages_are_always_rendered(self):
+        url = reverse('available_requests')
+        etag = self.etag(url)
+        blog_request = BlogRequest.objects.exclude(user=self.user).exclude(saves__user=self.user).first()
+        self.client.post(reverse('toggle-save-request', args=[blog_request.pk]), {'share_due_date': ''})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Пожалуйста, выберите дату.')
+
+    def test_missing_objects_are_still_404(self):
+        self.assertEqual(self.client.get(reverse('public_profile', args=[0])).status_code, 404)
+        other_request = BlogRequest.objects.exclude(user=self.user).first()
+        self.assertEqual(self.client.get(reverse('request_details', args=[other_request.pk])).status_code, 404)
+
+
+@override_settings(STORAGES=settings.STORAGES)
+class StaticPipelineTests(IsolatedTestCase):
+    def setUp(self):
+        build_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(build_dir.cleanup)
+        settings_override = override_settings(
+            STATIC_ROOT=os.path.join(build_dir.name, 'static'),
+            STATIC_BUNDLES_DIR=os.path.join(build_dir.name, 'bundles'),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.static_root = settings.STATIC_ROOT
+
+    def test_bundles_concatenate_their_sources_in_order(self):
+        for name, sources in settings.STATIC_BUNDLES.items():
+            with open(finders.find(name), encoding='utf-8') as bundle:
+                content = bundle.read()
+            offsets = [content.index(f'/* {source} */') for source in sources]
+            self.assertEqual(offsets, sorted(offsets), name)
+
+    def test_collected_files_are_fingerprinted_compressed_and_cached_for_good(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+        url = static('styling/bundle-requests.css')
+        self.assertRegex(url, r'^/static/styling/bundle-requests\.[0-9a-f]{12}\.css$')
+        self.assertTrue(os.path.exists(os.path.join(self.static_root, url[len('/static/'):] + '.gz')))
+
+        client = Client()
+        response = client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+        with open(finders.find('styling/bundle-requests.css'), 'rb') as bundle:
+            content = bundle.read()
+        self.assertEqual(gzip.decompress(response.getvalue()), content)
+
+        response = client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response.getvalue(), content)
+        response = client.head(url)
+        self.assertEqual((response['Content-Length'], response.content), (str(len(content)), b''))
+        # Plain names are still served, but revalidated soon
+        response = client.get('/static/styling/base.css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        self.assertEqual(client.get('/static/styling/base.css',
+                                    HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(client.get('/static/styling/missing.css').status_code, 404)
+
+    def test_pages_link_collected_files(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+        user = User.objects.create_user('viewer', password='pass')
+        self.client.force_login(user)
+        response = self.client.get(reverse('available_requests'))
+        self.assertContains(response, static('styling/bundle-available-requests.css'))
+        self.assertEqual(self.client.get(static('styling/bundle-available-requests.css')).status_code, 200)
+
+    async def test_files_are_streamed_under_asgi(self):
+        await sync_to_async(call_command)('collectstatic', interactive=False, verbosity=0)
+        url = static('styling/bundle-requests.css')
+        response = await AsyncClient().get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        # Read block by block in worker threads, not consumed whole by ASGIHandler
+        self.assertTrue(response.is_async)
+        content = b''.join([block async for block in response.streaming_content])
+        self.assertEqual(len(content), int(response['Content-Length']))
+        with open(finders.find('styling/bundle-requests.css'), 'rb') as bundle:
+            self.assertEqual(gzip.decompress(content), bundle.read())
+
+    def test_missing_manifest_fails_outside_debug(self):
+        storage = CompressedManifestStaticFilesStorage(location=self.static_root)
+        with self.assertRaisesMessage(ValueError, 'Missing staticfiles manifest entry'):
+            storage.stored_name('styling/base.css')
+        with override_settings(DEBUG=True):
+            self.assertEqual(storage.stored_name('styling/base.css'), 'styling/base.css')
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+
+    def test_plain_reads_go_to_replicas_and_writes_to_the_primary(self):
+        self.assertIn(self.router.db_for_read(BlogRequest), {'replica1', 'replica2'})
+        self.assertEqual(self.router.db_for_write(BlogRequest), 'default')
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.router.db_for_read(BlogRequest), 'default')
+
+    def test_reads_stay_on_the_primary_when_they_may_depend_on_a_write(self):
+        self.assertEqual(self.router.db_for_read(Session), 'default')
+        loaded = BlogRequest()
+        loaded._state.db = 'default'
+        self.assertEqual(self.router.db_for_read(SavedRequest, instance=loaded), 'default')
+
+        routing = RequestRouting(pinned=True)
+        token = current_routing.set(routing)
+        try:
+            self.assertEqual(self.router.db_for_read(BlogRequest), 'default')
+        finally:
+            current_routing.reset(token)
+
+    def test_the_middleware_pins_unsafe_requests_and_clients_that_wrote(self):
+        factory = RequestFactory()
+        seen = []
+
+        def view(request):
+            seen.append(self.router.db_for_read(BlogRequest))
+            if request.method == 'POST':
+                self.router.db_for_write(SavedRequest)
+            return HttpResponse()
+
+        middleware = ReplicaPinningMiddleware(view)
+        self.assertNotIn(PIN_COOKIE, middleware(factory.get('/')).cookies)
+        response = middleware(factory.post('/'))
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+        pinned = factory.get('/')
+        pinned.COOKIES[PIN_COOKIE] = '1'
+        middleware(pinned)
+        self.assertIn(seen[0], {'replica1', 'replica2'})
+        self.assertEqual(seen[1:], ['default', 'default'])
+
+    def test_replicas_are_never_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica1', 'main'))
+        self.assertIsNone(self.router.allow_migrate('default', 'main'))
+
+
+@skipUnless(settings.DATABASE_REPLICAS, 'needs a replica in DATABASES, e.g. DJANGO_DB_REPLICA_HOSTS')
+class ReplicaRoutingTests(IsolatedTransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.users, self.blog_requests = seed_marketplace(users=3, requests_per_user=2, saves_per_request=0)
+        self.client.force_login(self.users[0])
+
+    def queries_by_alias(self, action):
+        with ExitStack() as stack:
+            captured = {alias: stack.enter_context(CaptureQueriesContext(connections[alias]))
+                        for alias in connections}
+            response = action()
+        return response, {alias: len(queries) for alias, queries in captured.items() if len(queries)}
+
+    def test_listing_reads_from_a_replica_until_the_client_writes(self):
+        url = reverse('available_requests')
+        _, used = self.queries_by_alias(lambda: self.client.get(url))
+        self.assertTrue(set(used) & set(settings.DATABASE_REPLICAS), used)
+
+        blog_request = self.blog_requests[-1]
+        response, used = self.queries_by_alias(lambda: self.client.post(
+            reverse('toggle-save-request', args=[blog_request.pk]),
+            {'share_due_date': date.today().strftime('%Y-%m-%d')},
+        ))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(used), {'default'})
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        # The page the save redirects to already shows it
+        response, used = self.queries_by_alias(lambda: self.client.get(response.url))
+        self.assertEqual(set(used), {'default'})
+        self.assertNotContains(response, f'action="{reverse("toggle-save-request", args=[blog_request.pk])}"')
+
+
+class ConnectionBenchmarkTests(IsolatedTransactionTestCase):
+    # The benchmarked views read through the router, so from replicas when there are any
+    databases = '__all__'
+
+    def test_every_mode_serves_every_request(self):
+        out = StringIO()
+        call_command('benchmark_connections', users=6, requests=12, saves=10, total=9, commit=True, stdout=out)
+        report = json.loads(out.getvalue())
+        for mode in ('per_request', 'persistent'):
+            self.assertEqual(report[mode]['requests'], 9)
+            self.assertEqual(report[mode]['errors'], 0)
+        if connection.vendor != 'postgresql':
+            self.assertIn('skipped', report['pooled'])
+        self.assertFalse(User.objects.exists())
+        self.assertEqual(connection.settings_dict['CONN_MAX_AGE'], settings.DATABASES['default']['CONN_MAX_AGE'])
+
+
+class SessionBackendTests(IsolatedTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('viewer', password='pass')
+
+    def session_queries(self, engine):
+        with override_settings(SESSION_ENGINE=engine):
+            client = Client()
+            client.force_login(self.user)
+            client.get(reverse('home'))
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(reverse('home'))
+        self.assertContains(response, self.user.username)
+        return sum('django_session' in query['sql'] for query in queries.captured_queries)
+
+    def test_cached_and_cookie_sessions_skip_the_session_query(self):
+        self.assertEqual(self.session_queries(settings.SESSION_BACKENDS['db']), 1)
+        self.assertEqual(self.session_queries(settings.SESSION_BACKENDS['cached_db']), 0)
+        self.assertEqual(self.session_queries(settings.SESSION_BACKENDS['signed_cookies']), 0)
+
+    def test_expired_sessions_are_deleted_in_batches(self):
+        now = timezone.now()
+        Session.objects.bulk_create([
+            Session(session_key=f'expired{i:03}', session_data='', expire_date=now - timedelta(days=1))
+            for i in range(25)
+        ] + [Session(session_key='live', session_data='', expire_date=now + timedelta(days=1))])
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('clear_expired_sessions', batch_size=10, stdout=out)
+        self.assertIn('Deleted 25 expired sessions in 3 batches', out.getvalue())
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['live'])
+        self.assertEqual(sum(query['sql'].startswith('DELETE') for query in queries.captured_queries), 3)
+
+    def test_benchmark_shows_the_saved_query(self):
+        out = StringIO()
+        call_command('benchmark_sessions', users=6, requests=12, saves=10, repeat=1, stdout=out)
+        report = json.loads(out.getvalue())
+        for name, result in report['db'].items():
+            self.assertEqual(result['session_queries'], 1, name)
+            for backend in ('cached_db', 'signed_cookies'):
+                self.assertEqual(report[backend][name]['session_queries'], 0, name)
+                self.assertEqual(report[backend][name]['queries'], result['queries'] - 1, name)
@@ -1,21 +1,31 @@
+from django.conf import settings
 from django.urls import path
 from django.contrib.auth import views as auth_views
-from . import views
+from . import async_views, views
+
+# Async versions of the read-heavy pages when serving through ASGI, see settings.ASYNC_VIEWS
+read_views = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
-    path("", views.home, name="home"),
+    path("", read_views.home, name="home"),
+    path('calendar/', views.calendar_dates, name='calendar_dates'),
     path('profile/', views.profile, name='profile'),
-    path('profile/<int:user_id>/', views.public_profile, name='public_profile'),
+    path('profile/<int:user_id>/', read_views.public_profile, name='public_profile'),
 
     path('request/', views.create_request, name='request'),
     path('register/', views.register, name='register'),
-    path('available-requests/', views.available_requests, name="available_requests"),
+    path('available-requests/', read_views.available_requests, name="available_requests"),
+    path('available-requests/feed/', views.available_requests_feed, name="available_requests_feed"),
 
     path('requests/', views.show_requests, name='requests'),
+    path('requests/book/', views.book_requests, name='book_requests'),
     path('requests/<int:pk>/toggle-save/', views.toggle_save_request, name='toggle-save-request'),
     path('requests/<int:pk>/update/', views.update_request, name='update_request'),
     path('requests/<int:pk>/delete/', views.delete_request, name='delete_request'),
-    path('requests/<int:pk>/details/', views.request_details, name='request_details'),
+    path('requests/<int:pk>/availability/', views.request_availability, name='request_availability'),
+    path('requests/<int:pk>/details/', read_views.request_details, name='request_details'),
+
+    path('metrics/', views.metrics, name='metrics'),
 
     path("login/", auth_views.LoginView.as_view(template_name="webui/login.html"), name="login"),
     path("logout/", auth_views.LogoutView.as_view(next_page="home"), name="logout"),
@@ -1,15 +1,28 @@
+import hashlib
+from calendar import monthrange
 from datetime import date
 from datetime import datetime
-from django.core.serializers.json import DjangoJSONEncoder
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.contrib.auth import login
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import condition, require_POST
+from django.utils.cache import patch_cache_control
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db.models import Exists, OuterRef
+from django.template.loader import render_to_string
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
+from .availability import compute_free_slots
+from .calendar_cache import get_calendar, invalidate_calendars
+from .card_cache import accepted_request_cards, available_request_cards, created_request_cards
+from .conditional import (
+    available_requests_validators, conditional_page, public_profile_validators, request_details_validators,
+)
 from .forms import CustomUserCreationForm, BlogRequestForm, ProfileForm
-from .models import BlogRequest, SavedRequest, UserProfile
+from .matching import refresh_request_points
+from .metrics import BOOKINGS, REGISTRY
+from .models import GROUPSIZE_RANGES, BlogRequest, SavedRequest, UserProfile
 
 from django.contrib import messages
 import json
@@ -26,29 +39,32 @@ def register(request):
     return render(request, "webui/registration.html", {"form": form})
 
 def home(request):
-    if request.user.is_authenticated:
-        action_dates = list(
-            BlogRequest.objects.filter(saves__user=request.user).exclude(user=request.user)
-                .values_list('start_date', flat=True)
-        )
-        action_dates = [d.strftime("%Y-%m-%d") for d in action_dates]
-
-        # All SavedRequest rows that relate to requests YOU created:
-        my_requests = BlogRequest.objects.filter(user=request.user)
-        blue_dates = SavedRequest.objects.filter(request__in=my_requests).exclude(share_due_date=None)
-        # Dict: date string => id (for redirect)
-        request_due_map = {s.share_due_date.strftime("%Y-%m-%d"): s.request.id for s in blue_dates}
-        request_due_dates = list(request_due_map.keys())
-    else:
-        action_dates = []
-        request_due_dates = []
-        request_due_map = {}
-
-    return render(request, "webui/home.html", {
-        "action_dates": action_dates,
-        "request_due_dates": json.dumps(request_due_dates),
-        "request_due_map": json.dumps(request_due_map),
-    })
+    # Calendar data is loaded month by month from calendar_dates
+    return render(request, "webui/home.html")
+
+
+# Longest date range calendar_dates serves in one response
+CALENDAR_MAX_DAYS = 92
+
+
+@login_required
+def calendar_dates(request):
+    # Action and due dates of the current user for ?month=YYYY-MM or ?start=YYYY-MM-DD&end=YYYY-MM-DD
+    try:
+        month = request.GET.get('month')
+        if month:
+            date_from = datetime.strptime(month, '%Y-%m').date()
+            date_to = date_from.replace(day=monthrange(date_from.year, date_from.month)[1])
+        else:
+            date_from = datetime.strptime(request.GET.get('start', ''), '%Y-%m-%d').date()
+            date_to = datetime.strptime(request.GET.get('end', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Неверный формат даты'}, status=400)
+
+    if date_to < date_from or (date_to - date_from).days > CALENDAR_MAX_DAYS:
+        return JsonResponse({'success': False, 'error': 'Недопустимый диапазон дат'}, status=400)
+
+    return JsonResponse(get_calendar(request.user, date_from, date_to))
 
 
 @login_required
@@ -69,6 +85,7 @@ def profile(request):
         'profile': user_profile,
     })
 
+@conditional_page(public_profile_validators)
 def public_profile(request, user_id):
     user = get_object_or_404(User, pk=user_id)
     profile = user.profile  # OneToOneField ensures this exists
@@ -78,131 +95,343 @@ def public_profile(request, user_id):
     })
 
 
-@login_required
-def available_requests(request):
-    GROUPSIZE_RANGES = {
-        'size1': (0, 100),
-        'size2': (100, 500),
-        'size3': (500, 1000),
-        'size4': (1000, 1000000),
-    }
+# Number of cards rendered per page of the available requests feed
+AVAILABLE_REQUESTS_PAGE_SIZE = 20
+
+
+def _parse_cursor(cursor, sort):
+    # Cursor format is "<sort key>_<id>" of the last card already shown
+    try:
+        key, pk = cursor.split('_')
+        if sort == 'match':
+            return int(key), int(pk)
+        return datetime.strptime(key, '%Y-%m-%d').date(), int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _cards_queryset(qs, saved_qs):
+    # Everything a card renders: the saved flag and the owner's profile
+    return qs.annotate(saved=Exists(saved_qs)).select_related('user', 'user__profile')
+
+
+def _sorted_page_queryset(qs, saved_qs, cursor, sort, user):
+    if sort == 'match':
+        # Precomputed per-user scores from main.matching, read through matchscore_user_score_idx
+        qs = qs.filter(match_scores__user=user).annotate(match_score=F('match_scores__score'))
+        sort_field = 'match_score'
+    else:
+        sort_field = 'start_date'
 
+    # Keyset pagination: continue strictly after the last (sort key, id) shown
+    if cursor:
+        cursor_key, cursor_id = cursor
+        qs = qs.filter(Q(**{f'{sort_field}__lt': cursor_key}) | Q(**{sort_field: cursor_key, 'id__lt': cursor_id}))
+
+    # One extra row tells whether there is a next page
+    return _cards_queryset(qs, saved_qs).order_by(f'-{sort_field}', '-id')[:AVAILABLE_REQUESTS_PAGE_SIZE + 1]
+
+
+def _cut_sorted_page(requests, sort):
+    next_cursor = ''
+    if len(requests) > AVAILABLE_REQUESTS_PAGE_SIZE:
+        requests = requests[:AVAILABLE_REQUESTS_PAGE_SIZE]
+        last = requests[-1]
+        if sort == 'match':
+            next_cursor = f"{last.match_score}_{last.id}"
+        else:
+            next_cursor = f"{last.start_date.strftime('%Y-%m-%d')}_{last.id}"
+    return requests, next_cursor
+
+
+def _sorted_page(qs, saved_qs, cursor, sort, user):
+    requests = list(_sorted_page_queryset(qs, saved_qs, cursor, sort, user))
+    return _cut_sorted_page(requests, sort)
+
+
+def _earliest_free_windows(qs):
+    return qs.filter(available_to__gte=date.today()) \
+        .values_list('id', 'available_from', 'available_to', 'blocked_days')
+
+
+def _earliest_free_keys(availability, cursor):
+    # Page of (earliest free date, id) keys after the cursor; fully booked requests sort last
+    keys = sorted((earliest or date.max, pk) for pk, (earliest, _) in availability.items())
+    if cursor:
+        keys = [key for key in keys if key > cursor]
+
+    page_keys = keys[:AVAILABLE_REQUESTS_PAGE_SIZE]
+    next_cursor = ''
+    if len(keys) > AVAILABLE_REQUESTS_PAGE_SIZE:
+        last_date, last_id = page_keys[-1]
+        next_cursor = f"{last_date.strftime('%Y-%m-%d')}_{last_id}"
+    return page_keys, next_cursor
+
+
+def _earliest_free_page(qs, saved_qs, cursor):
+    # Soonest bookable requests first: all matching open requests go through one bitset pass,
+    # then only the cards of the page are loaded
+    availability = compute_free_slots(_earliest_free_windows(qs))
+    page_keys, next_cursor = _earliest_free_keys(availability, cursor)
+    by_id = _cards_queryset(qs, saved_qs).in_bulk([pk for _, pk in page_keys])
+    requests = [by_id[pk] for _, pk in page_keys if pk in by_id]
+    return requests, next_cursor, availability
+
+
+def _available_requests_query(request, user):
+    # Filter and sort options of the page and the querysets they select
     genre = request.GET.get('genre')
     groupsize = request.GET.get('groupsize')
+    sort = request.GET.get('sort')
 
-    saved_qs = SavedRequest.objects.filter(user=request.user, request=OuterRef('pk'))
-    qs = BlogRequest.objects.exclude(user=request.user).exclude(saves__user=request.user)
+    saved_qs = SavedRequest.objects.filter(user=user, request=OuterRef('pk'))
+    qs = BlogRequest.objects.exclude(user=user).exclude(saves__user=user)
 
     # Filter by genre and group size linked via user profile if provided
     if genre:
         qs = qs.filter(user__profile__genres=genre)
-    if groupsize:
+    if groupsize in GROUPSIZE_RANGES:
         low, high = GROUPSIZE_RANGES[groupsize]
-        qs = qs.filter(user__profile__subscribers_count__gte=low, user__profile__subscribers_count__lt=high)
-
-    requests = qs.annotate(saved=Exists(saved_qs)) \
-        .select_related('user', 'user__profile') \
-        .order_by('-start_date')
-
-    # Create blocked dates dictionary with properly formatted strings
-    blocked_dates = {
-        req.id: sorted(
-            {d.strftime("%Y-%m-%d") for d in
-             SavedRequest.objects.filter(request=req).values_list('share_due_date', flat=True)
-             if d is not None}
-            | set(req.unavailable_dates or [])
-        )
-        for req in requests
+        qs = qs.filter(user__profile__audience_size__gte=low, user__profile__audience_size__lt=high)
+
+    return {
+        'genre': genre,
+        'groupsize': groupsize,
+        'sort': sort,
+        'cursor': _parse_cursor(request.GET.get('cursor'), sort),
+        'qs': qs,
+        'saved_qs': saved_qs,
     }
 
-    context = {
+
+def _available_requests_context(query, requests, next_cursor, availability=None):
+    if availability is None:
+        availability = compute_free_slots(
+            (req.id, req.available_from, req.available_to, req.blocked_days) for req in requests
+        )
+
+    # Earliest free date and number of free days shown on each card
+    for req in requests:
+        req.earliest_free_date, req.free_slot_count = availability.get(req.id, (None, 0))
+
+    return {
         'requests': requests,
-        'selected_genre': genre or '',
-        'selected_groupsize': groupsize or '',
+        'next_cursor': next_cursor,
+        'selected_genre': query['genre'] or '',
+        'selected_groupsize': query['groupsize'] or '',
+        'selected_sort': query['sort'] or '',
         'today': date.today().isoformat(),
-        'blocked_dates_json': json.dumps(blocked_dates, cls=DjangoJSONEncoder)
     }
 
+
+def _available_requests_page(request):
+    query = _available_requests_query(request, request.user)
+    if query['sort'] == 'earliest':
+        requests, next_cursor, availability = _earliest_free_page(query['qs'], query['saved_qs'], query['cursor'])
+        return _available_requests_context(query, requests, next_cursor, availability)
+    requests, next_cursor = _sorted_page(query['qs'], query['saved_qs'], query['cursor'], query['sort'], request.user)
+    return _available_requests_context(query, requests, next_cursor)
+
+
+@login_required
+@conditional_page(available_requests_validators)
+def available_requests(request):
+    context = _available_requests_page(request)
+    context['cards'] = available_request_cards(request, context)
     return render(request, 'webui/available-requests.html', context)
 
 
 @login_required
-def toggle_save_request(request, pk):
+def available_requests_feed(request):
+    # Next page of cards for infinite scroll on the available requests page
+    context = _available_requests_page(request)
+    context['cards'] = available_request_cards(request, context)
+    html = render_to_string('webui/available-requests-cards.html', context, request=request)
+    return JsonResponse({
+        'html': html,
+        'next_cursor': context['next_cursor'],
+    })
+
+
+def _availability_etag(request, pk):
+    # The stored bitmap and its origin fully determine the response
+    row = BlogRequest.objects.filter(pk=pk).values_list('available_from', 'blocked_days').first()
+    if row is None:
+        return None
+    available_from, blocked_days = row
+    return hashlib.md5(available_from.isoformat().encode() + bytes(blocked_days)).hexdigest()
+
+
+@login_required
+@condition(etag_func=_availability_etag)
+def request_availability(request, pk):
     br = get_object_or_404(BlogRequest, pk=pk)
-    if request.method == 'POST':
-        share_due_date = request.POST.get('share_due_date')
-        user_has_saved = SavedRequest.objects.filter(user=request.user, request=br).exists()
-        # Remove request (cancelling)
-        if user_has_saved and not share_due_date:
-            SavedRequest.objects.filter(user=request.user, request=br).delete()
-
-        # Saving new request - must have a date
-        elif share_due_date:
-            try:
-                share_due_date_obj = datetime.strptime(share_due_date, '%Y-%m-%d').date()
-            except Exception:
-                return render(request, "webui/error.html", {"error": "Неверный формат даты."})
-
-            min_allowed = max(date.today(), br.available_from)
-            max_allowed = br.available_to
-
-            # --- Your new logic here ---
-            blocked_set = set(br.unavailable_dates or [])
-            # Also add all taken dates by other users (as strings)
-            taken_dates = SavedRequest.objects.filter(request=br).exclude(share_due_date=None).values_list('share_due_date', flat=True)
-            for d in taken_dates:
-                if d:
-                    blocked_set.add(d.strftime('%Y-%m-%d'))
-            share_due_str = share_due_date_obj.strftime('%Y-%m-%d')
-            if (share_due_str in blocked_set
-                    or share_due_date_obj < min_allowed
-                    or share_due_date_obj > max_allowed):
-                messages.error(request, "Эта дата недоступна для выбора. Пожалуйста, выберите другую дату.")
-                return redirect('available_requests')
-            # --- End your logic ---
-
-            # Continue with your existing logic
-            date_taken = SavedRequest.objects.filter(request=br, share_due_date=share_due_date).exists()
-            if date_taken:
-                messages.error(request, "Этот день уже занят для этой заявки.")
-                return redirect('available_requests')
-
-            # Not already saved and date is free
-            if not user_has_saved:
-                SavedRequest.objects.create(
-                    user=request.user,
-                    request=br,
-                    share_due_date=share_due_date
-                )
-        else:
+    # Runs of blocked days in flatpickr's {from, to} format
+    blocked_ranges = [
+        {'from': first.strftime('%Y-%m-%d'), 'to': last.strftime('%Y-%m-%d')}
+        for first, last in br.blocked_bitmap.ranges()
+    ]
+    response = JsonResponse({'blocked_ranges': blocked_ranges})
+    # Let the browser keep the payload but revalidate it on every open
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _redirect_after_toggle(request):
+    referer = request.META.get('HTTP_REFERER')
+    if referer and '/requests/' in referer and 'available' not in referer:
+        return redirect('requests')
+    else:
+        return redirect('available_requests')
+
+
+@login_required
+def toggle_save_request(request, pk):
+    if request.method != 'POST':
+        return redirect('available_requests')
+
+    share_due_date = request.POST.get('share_due_date')
+
+    # Remove request (cancelling)
+    if not share_due_date:
+        deleted, _ = SavedRequest.objects.filter(user=request.user, request_id=pk).delete()
+        if not deleted:
+            get_object_or_404(BlogRequest, pk=pk)
             messages.error(request, "Пожалуйста, выберите дату.")
             return redirect('available_requests')
+        return _redirect_after_toggle(request)
 
-        referer = request.META.get('HTTP_REFERER')
-        if referer and '/requests/' in referer and 'available' not in referer:
-            return redirect('requests')
-        else:
+    # Saving new request - must have a date
+    try:
+        share_due_date_obj = datetime.strptime(share_due_date, '%Y-%m-%d').date()
+    except ValueError:
+        return render(request, "webui/error.html", {"error": "Неверный формат даты."})
+
+    br = get_object_or_404(BlogRequest, pk=pk)
+
+    min_allowed = max(date.today(), br.available_from)
+    max_allowed = br.available_to
+    if (share_due_date_obj in br.blocked_bitmap
+            or share_due_date_obj < min_allowed
+            or share_due_date_obj > max_allowed):
+        BOOKINGS.inc('toggle', 'rejected')
+        messages.error(request, "Эта дата недоступна для выбора. Пожалуйста, выберите другую дату.")
+        return redirect('available_requests')
+
+    # Insert and let the unique constraints settle races: unique_share_date_per_request
+    # for the day itself, unique_save_per_user_request for a repeated save
+    try:
+        with transaction.atomic():
+            SavedRequest.objects.create(user=request.user, request=br, share_due_date=share_due_date_obj)
+    except IntegrityError:
+        if not SavedRequest.objects.filter(user=request.user, request=br).exists():
+            BOOKINGS.inc('toggle', 'conflict')
+            messages.error(request, DAY_TAKEN_ERROR)
             return redirect('available_requests')
+    else:
+        BOOKINGS.inc('toggle', 'success')
+
+    return _redirect_after_toggle(request)
+
+
+# Largest number of (request, date) pairs book_requests accepts in one call
+MAX_BATCH_BOOKINGS = 50
+
+DAY_TAKEN_ERROR = 'Этот день уже занят для этой заявки.'
+
+
+@login_required
+@require_POST
+def book_requests(request):
+    # Body: {"bookings": [{"request": <id>, "date": "YYYY-MM-DD"}, ...]}; results keep the input order
+    try:
+        items = json.loads(request.body)['bookings']
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return JsonResponse({'success': False, 'error': 'Неверный JSON'}, status=400)
+    if not isinstance(items, list) or len(items) > MAX_BATCH_BOOKINGS:
+        return JsonResponse({'success': False,
+                             'error': f'Можно забронировать не более {MAX_BATCH_BOOKINGS} дат за раз'}, status=400)
+
+    results = []
+    parsed = []
+    for item in items:
+        result = {'request': None, 'date': None, 'success': False}
+        results.append(result)
+        try:
+            result['request'] = int(item['request'])
+            result['date'] = item['date']
+            parsed.append((result, result['request'], datetime.strptime(item['date'], '%Y-%m-%d').date()))
+        except (KeyError, TypeError, ValueError):
+            result['error'] = 'Неверный формат данных'
+
+    # Everything needed for validation in two queries: the requests with their blocked-day
+    # bitmaps, and this user's existing bookings on them
+    request_ids = {request_id for _, request_id, _ in parsed}
+    blog_requests = BlogRequest.objects.exclude(user=request.user).in_bulk(request_ids)
+    blocked = {pk: br.blocked_bitmap for pk, br in blog_requests.items()}
+    already_saved = set(SavedRequest.objects.filter(user=request.user, request_id__in=request_ids)
+                        .values_list('request_id', flat=True))
+    taken = set()
+
+    today = date.today()
+    to_create = []
+    for result, request_id, day in parsed:
+        br = blog_requests.get(request_id)
+        if br is None:
+            result['error'] = 'Заявка не найдена'
+        elif request_id in already_saved:
+            result['error'] = 'Вы уже откликнулись на эту заявку.'
+        elif day < max(today, br.available_from) or day > br.available_to:
+            result['error'] = 'Эта дата недоступна для выбора.'
+        elif day in blocked[request_id] or (request_id, day) in taken:
+            result['error'] = DAY_TAKEN_ERROR
+        else:
+            # Later items in the same batch see this one as taken
+            taken.add((request_id, day))
+            already_saved.add(request_id)
+            to_create.append((result, SavedRequest(user=request.user, request=br, share_due_date=day)))
 
+    try:
+        with transaction.atomic():
+            SavedRequest.objects.bulk_create([saved for _, saved in to_create])
+        for result, _ in to_create:
+            result['success'] = True
+    except IntegrityError:
+        # Someone booked one of the days meanwhile: fall back to one savepoint per item to find out which
+        for result, saved in to_create:
+            try:
+                with transaction.atomic():
+                    saved.save(force_insert=True)
+                result['success'] = True
+            except IntegrityError:
+                result['error'] = DAY_TAKEN_ERROR
+
+    for result in results:
+        if result['success']:
+            BOOKINGS.inc('batch', 'success')
+        else:
+            BOOKINGS.inc('batch', 'conflict' if result.get('error') == DAY_TAKEN_ERROR else 'rejected')
+
+    # bulk_create sends no post_save, so clear the affected calendars here
+    booked = [saved for result, saved in to_create if result['success']]
+    if booked:
+        invalidate_calendars([request.user.id, *(saved.request.user_id for saved in booked)])
 
+    return JsonResponse({'success': True, 'results': results})
 
 
 @login_required
 def show_requests(request):
-    # Created requests by user with acceptance counts
+    # Created requests by user; acceptance_count is a denormalized column
     user_requests = BlogRequest.objects.filter(user=request.user).order_by('-start_date')
 
-    # Add acceptance count to each request
-    for req in user_requests:
-        req.acceptance_count = SavedRequest.objects.filter(request=req).count()
-
     # Accepted (saved) requests - Profile accepts requests that belong to others but saved by user
-    accepted_requests = BlogRequest.objects.filter(saves__user=request.user).exclude(user=request.user).order_by(
-        '-start_date')
+    accepted_requests = BlogRequest.objects.filter(saves__user=request.user).exclude(user=request.user) \
+        .select_related('user', 'user__profile').order_by('-start_date')
 
     context = {
-        'created_requests': user_requests,
-        'accepted_requests': accepted_requests,
+        'created_cards': created_request_cards(request, list(user_requests)),
+        'accepted_cards': accepted_request_cards(request, list(accepted_requests)),
     }
     return render(request, 'webui/requests.html', context)
 
@@ -215,6 +444,10 @@ def create_request(request):
             blog_request = form.save(commit=False)
             blog_request.user = request.user
             blog_request.save()
+            form.save_m2m()
+            # Slots exist once the request is saved, so mark the unavailable ones now
+            blog_request.set_unavailable_dates(form.cleaned_data['unavailable_dates'])
+            refresh_request_points(blog_request.pk)
             return redirect('requests')
     else:
         form = BlogRequestForm()
@@ -222,6 +455,7 @@ def create_request(request):
 
 
 @login_required
+@conditional_page(request_details_validators)
 def request_details(request, pk):
     blog_request = get_object_or_404(BlogRequest, pk=pk, user=request.user)
     acceptances = SavedRequest.objects.filter(request=blog_request).select_related('user', 'user__profile').order_by(
@@ -229,7 +463,7 @@ def request_details(request, pk):
     context = {
         'blog_request': blog_request,
         'acceptances': acceptances,
-        'acceptance_count': acceptances.count(),
+        'acceptance_count': blog_request.acceptance_count,
     }
     return render(request, 'webui/request-details.html', context)
 
@@ -261,7 +495,7 @@ def update_request(request, pk):
         else:
             return JsonResponse({'success': False, 'error': 'Недопустимое поле'})
 
-        blog_request.save()
+        blog_request.save(update_fields=[field])
         return JsonResponse({'success': True})
 
     except json.JSONDecodeError:
@@ -279,5 +513,11 @@ def delete_request(request, pk):
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)})
 
+@staff_member_required
+def metrics(request):
+    # Prometheus scrape target, summed over all worker processes when METRICS_DIR is set
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def custom_404(request, exception):
     return render(request, 'webui/page-not-found.html', status=404)
\ No newline at end of file
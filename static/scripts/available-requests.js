@@ -1,4 +1,117 @@
+// Blocked date ranges per availability URL, fetched once per page view
+const availabilityCache = {};
+
+function fetchBlockedRanges(url) {
+    if (!availabilityCache[url]) {
+        availabilityCache[url] = fetch(url, { credentials: 'same-origin' })
+            .then(response => response.json())
+            .then(data => data.blocked_ranges || [])
+            .catch(error => {
+                delete availabilityCache[url];
+                throw error;
+            });
+    }
+    return availabilityCache[url];
+}
+
+// flatpickr calendar initialization for every date input inside root
+function initDatePickers(root) {
+    if (typeof flatpickr === "undefined") {
+        return;
+    }
+    root.querySelectorAll('input.styled-date').forEach(input => {
+        if (input._flatpickr) {
+            return; // already initialized
+        }
+        let disables = [];
+        let min = input.getAttribute('min');
+        let max = input.getAttribute('max');
+
+        flatpickr(input, {
+            dateFormat: "Y-m-d",
+            minDate: min,
+            maxDate: max,
+            locale: "ru",
+            monthSelectorType: 'static', // optional, keeps month buttons visible
+            onOpen: function(selectedDates, dateStr, fp) {
+                // Blocked ranges are loaded lazily the first time the calendar opens
+                fetchBlockedRanges(input.dataset.availabilityUrl)
+                    .then(ranges => {
+                        disables = ranges;
+                        fp.set('disable', disables);
+                        fp.redraw();
+                    })
+                    .catch(error => console.error('Ошибка загрузки дат:', error));
+            },
+            onDayCreate: function(dObj, dStr, fp, dayElem) {
+                // Add visual indication for disabled dates
+                var dateISO = dayElem.dateObj.getFullYear() + "-" +
+                              String(dayElem.dateObj.getMonth() + 1).padStart(2, '0') + "-" +
+                              String(dayElem.dateObj.getDate()).padStart(2, '0');
+                // ISO dates compare correctly as strings
+                if (disables.some(range => range.from <= dateISO && dateISO <= range.to)) {
+                    dayElem.classList.add('taken-date');
+                }
+            }
+        });
+    });
+}
+
+// Infinite scroll: load the next page of cards when the sentinel becomes visible
+function initInfiniteScroll() {
+    const container = document.getElementById('requests-container');
+    const sentinel = document.getElementById('requests-sentinel');
+    if (!container || !sentinel || !('IntersectionObserver' in window)) {
+        return;
+    }
+    let loading = false;
+
+    const observer = new IntersectionObserver(function(entries) {
+        if (!entries.some(entry => entry.isIntersecting)) {
+            return;
+        }
+        const cursor = container.dataset.nextCursor;
+        if (!cursor) {
+            observer.disconnect();
+            return;
+        }
+        if (loading) {
+            return;
+        }
+        loading = true;
+
+        // Keep the genre/groupsize filters of the current page
+        const params = new URLSearchParams(window.location.search);
+        params.set('cursor', cursor);
+
+        fetch(container.dataset.feedUrl + '?' + params.toString(), {
+            headers: { 'X-Requested-With': 'XMLHttpRequest' },
+            credentials: 'same-origin'
+        })
+            .then(response => response.json())
+            .then(data => {
+                const page = document.createElement('div');
+                page.innerHTML = data.html;
+                while (page.firstChild) {
+                    container.appendChild(page.firstChild);
+                }
+                initDatePickers(container);
+                container.dataset.nextCursor = data.next_cursor;
+                if (!data.next_cursor) {
+                    observer.disconnect();
+                }
+            })
+            .catch(error => console.error('Ошибка загрузки заявок:', error))
+            .finally(() => { loading = false; });
+    }, { rootMargin: '200px' });
+
+    observer.observe(sentinel);
+}
+
 document.addEventListener('DOMContentLoaded', function() {
+    initDatePickers(document);
+    initInfiniteScroll();
+
     document.querySelectorAll(".toggle-btn").forEach((button) => {
         button.addEventListener("click", function () {
             const card = this.closest(".request-card");
@@ -7,14 +7,38 @@ const monthNames = [
     "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"
 ];
 
-function isActionDay(date) {
-    return actionDates.includes(date);
+const emptyMonth = { action_dates: [], request_due_map: {} };
+// Memoized month payloads: "YYYY-MM" => Promise of { action_dates, request_due_map }
+const monthCache = {};
+
+function monthKey(year, month) {
+    return `${year}-${month.toString().padStart(2, '0')}`;
 }
-function isRequestDueDay(date) {
-    return requestDueDates.includes(date);
+
+function fetchMonth(year, month) {
+    const url = document.getElementById("calendar").dataset.calendarUrl;
+    if (!url) {
+        return Promise.resolve(emptyMonth); // anonymous visitors have no calendar data
+    }
+    const key = monthKey(year, month);
+    if (!monthCache[key]) {
+        monthCache[key] = fetch(url + "?month=" + key, { credentials: 'same-origin' })
+            .then(response => response.json())
+            .catch(error => {
+                delete monthCache[key];
+                console.error('Ошибка загрузки календаря:', error);
+                return emptyMonth;
+            });
+    }
+    return monthCache[key];
 }
 
-function renderCalendar(year, month) {
+function renderCalendar(year, month, data) {
+    const actionDates = data.action_dates || [];
+    const requestDueMap = data.request_due_map || {};
+    const isActionDay = date => actionDates.includes(date);
+    const isRequestDueDay = date => date in requestDueMap;
+
     const calendar = document.getElementById("calendar");
     calendar.innerHTML = '';
     let d = new Date(year, month - 1, 1);
@@ -101,8 +125,18 @@ function updateCalendarHeader() {
 }
 
 function redrawCalendar() {
-    renderCalendar(currentYear, currentMonth);
+    const year = currentYear;
+    const month = currentMonth;
     updateCalendarHeader();
+    fetchMonth(year, month).then(data => {
+        // Ignore responses for months the user has already navigated away from
+        if (year === currentYear && month === currentMonth) {
+            renderCalendar(year, month, data);
+        }
+    });
+    // Prefetch the neighbouring months so navigation feels instant
+    fetchMonth(month === 1 ? year - 1 : year, month === 1 ? 12 : month - 1);
+    fetchMonth(month === 12 ? year + 1 : year, month === 12 ? 1 : month + 1);
 }
 
 // --- On page load ---